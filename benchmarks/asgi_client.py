@@ -0,0 +1,107 @@
+import asyncio
+import json
+from collections import namedtuple
+from contextlib import asynccontextmanager
+
+# Minimal in-process HTTP client for ASGI apps, so load tests measure the
+# application and not a socket stack or an HTTP client library
+
+Response = namedtuple('Response', 'status headers body')
+
+
+def parse_set_cookies(headers: list, cookies: dict):
+    # Applies Set-Cookie headers to a cookie jar, deleted cookies are dropped
+    for name, value in headers:
+        if name != b'set-cookie':
+            continue
+        pair = value.decode().split(';', 1)[0]
+        key, _, val = pair.partition('=')
+        val = val.strip('"')
+        if val and 'max-age=0' not in value.decode().lower():
+            cookies[key.strip()] = val
+        else:
+            cookies.pop(key.strip(), None)
+
+
+class ASGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, json_body=None, headers: dict = None,
+                      cookies: dict = None, client: tuple = ('127.0.0.1', 50000)) -> Response:
+        body = json.dumps(json_body).encode() if json_body is not None else b''
+        path, _, query = path.partition('?')
+
+        raw_headers = [(b'host', b'bench')]
+        if json_body is not None:
+            raw_headers.append((b'content-type', b'application/json'))
+            raw_headers.append((b'content-length', str(len(body)).encode()))
+        if cookies:
+            cookie = '; '.join(f'{key}={value}' for key, value in cookies.items())
+            raw_headers.append((b'cookie', cookie.encode()))
+        for key, value in (headers or {}).items():
+            raw_headers.append((key.lower().encode(), value.encode()))
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': raw_headers,
+            'client': client,
+            'server': ('bench', 80),
+        }
+
+        request_sent = False
+        response_done = asyncio.Event()
+        status = None
+        response_headers = []
+        response_body = bytearray()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Streaming responses listen for a disconnect while they send
+            await response_done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers = list(message.get('headers', []))
+            elif message['type'] == 'http.response.body':
+                response_body.extend(message.get('body', b''))
+                if not message.get('more_body', False):
+                    response_done.set()
+
+        await self.app(scope, receive, send)
+        response_done.set()
+        return Response(status, response_headers, bytes(response_body))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs the app's startup and shutdown handlers around the block
+    to_app = asyncio.Queue()
+    from_app = asyncio.Queue()
+    task = asyncio.create_task(
+        app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, to_app.get, from_app.put))
+
+    await to_app.put({'type': 'lifespan.startup'})
+    message = await from_app.get()
+    if message['type'] != 'lifespan.startup.complete':
+        raise RuntimeError(f"App startup failed: {message}")
+    try:
+        yield
+    finally:
+        await to_app.put({'type': 'lifespan.shutdown'})
+        await from_app.get()
+        await task
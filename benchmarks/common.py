@@ -0,0 +1,45 @@
+import asyncio
+import json
+import time
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    # Latencies are collected in seconds and reported in milliseconds
+    return {
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run_for(duration: float, concurrency: int, operation) -> tuple:
+    # Runs `operation(worker_index, iteration)` from `concurrency` tasks until
+    # `duration` seconds have passed and returns (latencies, elapsed)
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int):
+        iteration = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await operation(index, iteration)
+            latencies.append(time.perf_counter() - started)
+            iteration += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def report(results: dict):
+    print(json.dumps(results, indent=2))
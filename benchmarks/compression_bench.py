@@ -0,0 +1,81 @@
+"""CPU spent compressing item payloads against the bytes it saves, per gzip
+level. No server needed:
+
+    python -m benchmarks.compression_bench --levels 1 5 9
+
+`break_even_mbit_s` is the link speed under which compressing is faster end
+to end than sending the raw body: saved bits / CPU seconds. Cached pages
+of GET /items/ pay the CPU once per cache fill, not per request.
+"""
+import argparse
+import time
+import zlib
+from benchmarks import settings
+
+settings.apply()
+
+from pydantic_core import to_json  # noqa: E402
+from benchmarks.common import report  # noqa: E402
+from services.items_services import items_json  # noqa: E402
+
+
+def rows(count: int) -> list:
+    return [(i, f'item-{i}', i % 1000) for i in range(count)]
+
+
+def compress_whole(body: bytes, level: int) -> int:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return len(compressor.compress(body) + compressor.flush())
+
+
+def compress_stream(chunks: list, level: int) -> int:
+    # As CompressionMiddleware does for streamed responses, flushed per chunk
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    size = 0
+    for chunk in chunks[:-1]:
+        size += len(compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    return size + len(compressor.compress(chunks[-1]) + compressor.flush())
+
+
+def measure(compress, payload, raw_size: int, level: int, runs: int) -> dict:
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        size = compress(payload, level)
+        best = min(best, time.perf_counter() - started)
+    saved = raw_size - size
+    return {
+        'bytes': size,
+        'ratio': round(raw_size / size, 2),
+        'cpu_ms': round(best * 1000, 3),
+        'mb_per_cpu_s': round(raw_size / best / 1e6, 1),
+        'break_even_mbit_s': round(saved * 8 / best / 1e6, 1),
+    }
+
+
+def main(levels: list, runs: int):
+    # Pages of GET /items/ and a /items/stream download in 1000 row batches
+    payloads = {
+        'page_100': (compress_whole, items_json(rows(100))),
+        'page_1000': (compress_whole, items_json(rows(1000))),
+        'stream_100k': (compress_stream, [
+            b''.join(to_json({'id': item_id, 'name': name, 'quantity': quantity}) + b'\n'
+                     for item_id, name, quantity in rows(100000)[start:start + 1000])
+            for start in range(0, 100000, 1000)]),
+    }
+
+    results = {}
+    for name, (compress, payload) in payloads.items():
+        raw_size = len(payload) if isinstance(payload, bytes) else sum(map(len, payload))
+        results[name] = {'raw_bytes': raw_size}
+        for level in levels:
+            results[name][f'gzip_{level}'] = measure(compress, payload, raw_size, level, runs)
+    report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 5, 9])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    main(args.levels, args.runs)
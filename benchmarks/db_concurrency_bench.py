@@ -0,0 +1,63 @@
+"""Latency of concurrent requests with the sync Session (blocking the event
+loop, as before) versus the async session.
+
+Needs the Postgres server configured in .env:
+
+    python -m benchmarks.db_concurrency_bench --requests 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from benchmarks.common import report, summarize
+from utils import db
+
+# Every simulated request runs one query that takes this long in Postgres
+QUERY = text("SELECT pg_sleep(:delay)")
+
+
+async def sync_request(delay: float):
+    # What the handlers did before: a psycopg2 query inside `async def`
+    session = sessionmaker(bind=db.get_engine())()
+    try:
+        session.execute(QUERY, {"delay": delay})
+    finally:
+        session.close()
+
+
+async def async_request(delay: float):
+    async with db.new_session() as session:
+        await session.execute(QUERY, {"delay": delay})
+
+
+async def measure(request, requests: int, concurrency: int, delay: float) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await request(delay)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def main(requests: int, concurrency: int, delay: float):
+    report({
+        "sync_session": await measure(sync_request, requests, concurrency, delay),
+        "async_session": await measure(async_request, requests, concurrency, delay),
+    })
+    await db.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
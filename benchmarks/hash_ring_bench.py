@@ -0,0 +1,51 @@
+"""Key spread over the rate limiter's hash ring and how many keys move when
+a node joins or leaves. Needs no Redis:
+
+    python -m benchmarks.hash_ring_bench --nodes 3 --keys 100000
+
+To run the limiter itself on several local nodes:
+
+    redis-server --port 6380 --save '' & redis-server --port 6381 --save '' &
+    RATE_LIMIT_REDIS_NODES=redis://localhost:6379,redis://localhost:6380,redis://localhost:6381 \\
+        python -m benchmarks.leaky_bucket_bench
+"""
+import argparse
+import time
+from collections import Counter
+from benchmarks.common import report
+from utils.hash_ring import HashRing
+
+
+def main(nodes: int, keys: int):
+    urls = [f'redis://localhost:{6379 + i}' for i in range(nodes)]
+    names = [f'rate_limit:10.0.{i // 256}.{i % 256}' for i in range(keys)]
+    ring = HashRing(urls)
+
+    started = time.perf_counter()
+    before = {name: ring.get_node(name) for name in names}
+    lookup_us = (time.perf_counter() - started) / keys * 1e6
+
+    spread = Counter(before.values())
+
+    ring.add_node(f'redis://localhost:{6379 + nodes}')
+    moved_on_add = sum(ring.get_node(name) != before[name] for name in names)
+    ring.remove_node(f'redis://localhost:{6379 + nodes}')
+    ring.remove_node(urls[0])
+    moved_on_remove = sum(ring.get_node(name) != before[name] for name in names)
+
+    report({
+        'lookup_us': round(lookup_us, 3),
+        'keys_per_node': {url: spread[url] for url in urls},
+        'moved_on_add': round(moved_on_add / keys, 4),
+        'ideal_on_add': round(1 / (nodes + 1), 4),
+        'moved_on_remove': round(moved_on_remove / keys, 4),
+        'ideal_on_remove': round(1 / nodes, 4),
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--keys', type=int, default=100000)
+    args = parser.parse_args()
+    main(args.nodes, args.keys)
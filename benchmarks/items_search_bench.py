@@ -0,0 +1,95 @@
+"""Latency of the GET /items/search queries on a large items table, without
+the indexes of migrations/001_items_search_indexes.sql and
+004_items_name_lower.sql and with them:
+
+    python -m benchmarks.items_search_bench --rows 1000000 --runs 20
+
+Only runs against a database whose name starts with 'bench', the items
+table is replaced.
+"""
+import argparse
+import asyncio
+import time
+from benchmarks import settings
+
+settings.apply()
+
+from sqlalchemy import text  # noqa: E402
+from benchmarks.common import percentile, report  # noqa: E402
+from database import items_crud  # noqa: E402
+from utils import db  # noqa: E402
+from utils.migrations import apply_migrations  # noqa: E402
+
+INDEXES = ('ix_items_name_pattern', 'ix_items_name_lower_pattern', 'ix_items_name_trgm',
+           'ix_items_quantity_id', 'ix_items_name_id')
+MIGRATIONS = ('001_items_search_indexes.sql', '004_items_name_lower.sql')
+
+# name -> search_items keyword arguments
+QUERIES = {
+    'prefix': {'q': 'item-12345', 'match': 'prefix'},
+    'substring': {'q': '4242', 'match': 'substring'},
+    'quantity_range': {'min_quantity': 100, 'max_quantity': 110, 'sort': 'quantity'},
+    'sort_name_desc': {'sort': 'name', 'order': 'desc'},
+    'deep_page_by_quantity': {'sort': 'quantity', 'after': (500, 500000)},
+}
+
+
+def seed(rows: int):
+    if not db.db_database.startswith('bench'):
+        raise RuntimeError(
+            f"Refusing to seed database {db.db_database!r}, its name must start with 'bench'")
+    db.create_schema()
+    with db.get_engine().begin() as connection:
+        connection.execute(text('TRUNCATE items RESTART IDENTITY'))
+        connection.execute(text(
+            "INSERT INTO items (name, quantity) "
+            "SELECT 'item-' || i, i % 1000 FROM generate_series(1, :rows) AS i"), {'rows': rows})
+        connection.execute(text('ANALYZE items'))
+
+
+def drop_indexes():
+    with db.get_engine().connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        for name in INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+        # Lets apply_migrations create them again
+        if connection.execute(text("SELECT to_regclass('schema_migrations')")).scalar():
+            connection.execute(text("DELETE FROM schema_migrations WHERE name = ANY(:names)"),
+                               {'names': list(MIGRATIONS)})
+
+
+async def measure(runs: int) -> dict:
+    results = {}
+    async with db.new_session() as session:
+        for name, kwargs in QUERIES.items():
+            latencies = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                await items_crud.search_items(session, **kwargs)
+                latencies.append(time.perf_counter() - started)
+            results[name] = {
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            }
+    return results
+
+
+async def main(rows: int, runs: int):
+    seed(rows)
+    drop_indexes()
+    without_indexes = await measure(runs)
+
+    apply_migrations()
+    with db.get_engine().begin() as connection:
+        connection.execute(text('ANALYZE items'))
+    with_indexes = await measure(runs)
+
+    report({'rows': rows, 'without_indexes': without_indexes, 'with_indexes': with_indexes})
+    await db.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.runs))
@@ -0,0 +1,75 @@
+"""Compares the Lua leaky bucket against the previous two-pipeline version
+and the hybrid local + Redis mode.
+
+Needs a Redis server on localhost:6379:
+
+    python -m benchmarks.leaky_bucket_bench --duration 10 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.common import report, run_for, summarize
+from utils.hybrid_bucket import HybridLeakyBucket
+from utils.leaky_bucket import BUCKET_CAPACITY, LEAK_RATE, leaky_bucket
+from utils.redis_connection import close_redis, get_redis
+
+
+async def legacy_leaky_bucket(request_id: str) -> bool:
+    # Implementation before the server-side script: two round trips and no
+    # atomicity between the read and the write
+    current_time = time.time()
+
+    async with get_redis().pipeline(transaction=True) as pipe:
+        last_updated, bucket_size = await (pipe
+                                           .get(f"{request_id}_last_updated")
+                                           .get(f"{request_id}_bucket_size")
+                                           .execute())
+
+        last_updated = float(last_updated or current_time)
+        bucket_size = int(bucket_size or 0)
+
+        leaked = int((current_time - last_updated) * LEAK_RATE)
+        bucket_size = max(0, bucket_size - leaked)
+
+        if bucket_size < BUCKET_CAPACITY:
+            bucket_size += 1
+            await (pipe
+                   .set(f"{request_id}_last_updated", current_time)
+                   .set(f"{request_id}_bucket_size", bucket_size)
+                   .execute())
+            return True
+        return False
+
+
+async def main(duration: float, concurrency: int, clients: int):
+    results = {}
+    hybrid = HybridLeakyBucket()
+    variants = (("legacy", legacy_leaky_bucket), ("script", leaky_bucket),
+                ("hybrid", hybrid.allow))
+    for name, check in variants:
+        async def operation(worker, iteration, check=check):
+            await check(f"bench-{name}-{(worker * 7919 + iteration) % clients}")
+
+        latencies, elapsed = await run_for(duration, concurrency, operation)
+        results[name] = summarize(latencies, elapsed)
+
+    await hybrid.stop()
+    results["hybrid"]["redis_calls"] = hybrid.redis_calls
+    results["hybrid"]["local_decisions"] = hybrid.local_decisions
+
+    legacy_rps = results["legacy"]["requests_per_sec"]
+    results["speedup"] = {
+        "script": round(results["script"]["requests_per_sec"] / legacy_rps, 2),
+        "hybrid": round(results["hybrid"]["requests_per_sec"] / legacy_rps, 2),
+    }
+    report(results)
+    await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.duration, args.concurrency, args.clients))
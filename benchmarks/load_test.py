@@ -0,0 +1,194 @@
+"""Load test of main.app driven in-process at a fixed concurrency.
+
+Start the stand-ins, then run a traffic mix and keep the JSON report to
+compare it with other commits:
+
+    docker compose -f benchmarks/docker-compose.yml up -d
+    python -m benchmarks.load_test --mix default --duration 30 --output before.json
+
+The rules of benchmarks/rate_limit_policy.json apply unless
+RATE_LIMIT_POLICY_FILE is set: the defaults, except that the per-user GET
+/items rule is raised out of reach. The test logs in --readers users only,
+so with the default 100 requests per 10 s per user the items routes would
+mostly measure 429s. The limiter still runs on every request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from collections import defaultdict
+from benchmarks import settings
+
+settings.apply()
+POLICY_FILE = os.environ.setdefault(
+    'RATE_LIMIT_POLICY_FILE', os.path.join(os.path.dirname(__file__), 'rate_limit_policy.json'))
+
+from benchmarks.asgi_client import ASGIClient, lifespan, parse_set_cookies  # noqa: E402
+from benchmarks.common import summarize  # noqa: E402
+from benchmarks.seed import BENCH_ADMIN, BENCH_PASSWORD, bench_username, seed  # noqa: E402
+
+# Relative weights of the operations of every traffic mix
+MIXES = {
+    'default': {'items': 70, 'items_next_page': 5, 'admin': 10, 'authenticate': 10, 'register': 5},
+    'read_heavy': {'items': 85, 'items_next_page': 10, 'admin': 5},
+    'auth_heavy': {'items': 30, 'authenticate': 50, 'register': 20},
+}
+
+
+class LoadTest:
+    def __init__(self, app, users: int, readers: int):
+        self.client = ASGIClient(app)
+        self.users = users
+        self.readers = readers
+        self.reader_cookies = []
+        self.admin_cookies = {}
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.requests = 0
+        self.registered = 0
+
+    def next_client(self) -> tuple:
+        # A different address per request keeps the per-IP rate limiter
+        # from throttling the load generator while still running it
+        self.requests += 1
+        n = self.requests
+        return (f'10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}', 50000)
+
+    async def call(self, route: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        response = await self.client.request(method, path, client=self.next_client(), **kwargs)
+        self.latencies[route].append(time.perf_counter() - started)
+        self.statuses[route][response.status] += 1
+        return response
+
+    async def login(self, username: str) -> dict:
+        response = await self.client.request(
+            'POST', '/users/authenticate', client=self.next_client(),
+            json_body={'username': username, 'password': BENCH_PASSWORD})
+        if response.status != 200:
+            raise RuntimeError(f"Login of {username} failed with {response.status}")
+        cookies = {}
+        parse_set_cookies(response.headers, cookies)
+        return cookies
+
+    async def setup(self):
+        self.admin_cookies = await self.login(BENCH_ADMIN)
+        self.reader_cookies = [await self.login(bench_username(i))
+                               for i in range(min(self.readers, self.users))]
+
+    async def items(self):
+        await self.call('GET /items/', 'GET', '/items/?limit=100',
+                        cookies=random.choice(self.reader_cookies))
+
+    async def items_next_page(self):
+        cookies = random.choice(self.reader_cookies)
+        first = await self.call('GET /items/', 'GET', '/items/?limit=100', cookies=cookies)
+        cursor = dict(first.headers).get(b'x-next-cursor')
+        if cursor:
+            await self.call('GET /items/?cursor', 'GET',
+                            f'/items/?limit=100&cursor={cursor.decode()}', cookies=cookies)
+
+    async def admin(self):
+        username = bench_username(random.randrange(self.users))
+        await self.call('GET /admin/{username}', 'GET', f'/admin/{username}',
+                        cookies=self.admin_cookies)
+
+    async def authenticate(self):
+        # Paired with a logout so users stay under the session cap
+        username = bench_username(random.randrange(self.readers, self.users)
+                                 if self.users > self.readers else random.randrange(self.users))
+        response = await self.call('POST /users/authenticate', 'POST', '/users/authenticate',
+                                   json_body={'username': username, 'password': BENCH_PASSWORD})
+        cookies = {}
+        parse_set_cookies(response.headers, cookies)
+        if response.status == 200:
+            await self.call('POST /users/logout', 'POST', '/users/logout', cookies=cookies)
+
+    async def register(self):
+        self.registered += 1
+        username = f'bench-new-{time.time_ns()}-{self.registered}'
+        await self.call('POST /users/register', 'POST', '/users/register',
+                        json_body={'username': username, 'password': BENCH_PASSWORD})
+
+    async def run(self, mix: dict, duration: float, concurrency: int) -> float:
+        operations = [getattr(self, name) for name in mix]
+        weights = list(mix.values())
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                await random.choices(operations, weights)[0]()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            routes[route] = summarize(latencies, elapsed)
+            routes[route]['statuses'] = dict(self.statuses[route])
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            'elapsed_sec': round(elapsed, 3),
+            'requests': total,
+            'requests_per_sec': round(total / elapsed, 1) if elapsed else 0.0,
+            'routes': routes,
+        }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def main(args):
+    if not args.skip_seed:
+        await seed(args.users, args.items)
+
+    from main import app
+
+    async with lifespan(app):
+        test = LoadTest(app, args.users, args.readers)
+        await test.setup()
+        if args.warmup:
+            await test.run(MIXES[args.mix], args.warmup, args.concurrency)
+            test.latencies.clear()
+            test.statuses.clear()
+        elapsed = await test.run(MIXES[args.mix], args.duration, args.concurrency)
+
+    result = {
+        'revision': git_revision(),
+        'mix': args.mix,
+        'concurrency': args.concurrency,
+        'users': args.users,
+        'items': args.items,
+        'rate_limit_policy_file': POLICY_FILE,
+        **test.report(elapsed),
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mix', choices=sorted(MIXES), default='default')
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--readers', type=int, default=50)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--output')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""Overload behaviour with and without ConcurrencyLimitMiddleware, against a
+stand-in app whose latency grows once more than --capacity requests run at
+the same time (a saturated database or CPU). No services needed:
+
+    python -m benchmarks.overload_bench --offered 4000 --capacity 20
+
+`offered` requests per second arrive on a schedule, whatever the answers,
+as clients do during an overload.
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.asgi_client import ASGIClient
+from benchmarks.common import report, summarize
+from middlewares.concurrency_limit_middleware import ConcurrencyLimitMiddleware
+from utils.concurrency_limits import ConcurrencyGroups
+
+
+def saturating_app(capacity: int, service_time: float):
+    in_flight = 0
+
+    async def app(scope, receive, send):
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            await asyncio.sleep(service_time * max(1.0, in_flight / capacity))
+        finally:
+            in_flight -= 1
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'ok'})
+    return app
+
+
+async def run(app, offered: int, duration: float) -> dict:
+    client = ASGIClient(app)
+    latencies = []
+    statuses = {}
+
+    async def one():
+        started = time.perf_counter()
+        response = await client.request('GET', '/items/')
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.status == 200:
+            latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    started = time.perf_counter()
+    tick = 0.01
+    while time.perf_counter() - started < duration:
+        tasks.extend(asyncio.ensure_future(one()) for _ in range(int(offered * tick)))
+        await asyncio.sleep(tick)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed)
+    result['statuses'] = statuses
+    return result
+
+
+async def main(offered: int, duration: float, capacity: int, service_time: float):
+    groups = ConcurrencyGroups([{
+        'name': 'reads', 'prefixes': ['/'], 'initial_limit': 4, 'min_limit': 2,
+        'max_limit': 1000, 'queue_size': 50, 'queue_timeout': 0.2}])
+    limited = ConcurrencyLimitMiddleware(saturating_app(capacity, service_time), groups)
+
+    results = {
+        'unlimited': await run(saturating_app(capacity, service_time), offered, duration),
+        'limited': await run(limited, offered, duration),
+    }
+    results['limited']['final_limit'] = groups.limiters[0].limit
+    report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--offered', type=int, default=4000)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--capacity', type=int, default=20)
+    parser.add_argument('--service-time', type=float, default=0.01)
+    args = parser.parse_args()
+    asyncio.run(main(args.offered, args.duration, args.capacity, args.service_time))
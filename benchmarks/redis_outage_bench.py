@@ -0,0 +1,64 @@
+"""Latency the rate limiter adds while its Redis node is unreachable. By
+default the node is an unroutable address, so connecting hangs until the
+deadline; no Redis is needed:
+
+    python -m benchmarks.redis_outage_bench --duration 10 --concurrency 20
+
+The first requests pay up to RATE_LIMIT_REDIS_TIMEOUT, then the circuit
+breaker opens and requests fall back (RATE_LIMIT_ON_ERROR) without waiting.
+"""
+import argparse
+import asyncio
+import os
+import time
+from benchmarks import settings
+
+settings.apply()
+os.environ.setdefault('RATE_LIMIT_REDIS_NODES', 'redis://10.255.255.1:6379')
+
+from benchmarks.asgi_client import ASGIClient  # noqa: E402
+from benchmarks.common import report, run_for, summarize  # noqa: E402
+from middlewares.rate_limit_middleware import RateLimitMiddleware  # noqa: E402
+from utils import metrics  # noqa: E402
+from utils.rate_limit_policies import policy_table  # noqa: E402
+
+
+async def ok_app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+async def main(duration: float, concurrency: int):
+    client = ASGIClient(RateLimitMiddleware(ok_app))
+    statuses = {}
+    window = []  # (seconds since start, latency)
+    started = time.perf_counter()
+
+    async def operation(worker, iteration):
+        request_started = time.perf_counter()
+        response = await client.request(
+            'GET', '/items/', client=(f'10.0.{worker}.{iteration % 250}', 50000))
+        window.append((request_started - started, time.perf_counter() - request_started))
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    latencies, elapsed = await run_for(duration, concurrency, operation)
+    first_second = [latency for at, latency in window if at < 1]
+    after = [latency for at, latency in window if at >= 1]
+    report({
+        'redis_nodes': os.environ['RATE_LIMIT_REDIS_NODES'],
+        'overall': summarize(latencies, elapsed),
+        'first_second': summarize(first_second, 1),
+        'after_first_second': summarize(after, max(elapsed - 1, 1e-9)),
+        'statuses': statuses,
+        'breaker_metrics': [line for line in metrics.render().splitlines()
+                            if line.startswith(('circuit_breaker', 'rate_limit_fallback'))],
+    })
+    await policy_table.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.duration, args.concurrency))
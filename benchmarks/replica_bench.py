@@ -0,0 +1,97 @@
+"""Where read sessions go with a streaming replica, and how fast they move
+to the primary when the replica falls behind. Needs the postgres and
+postgres-replica services of benchmarks/docker-compose.yml:
+
+    python -m benchmarks.replica_bench --reads 500
+
+Replay is paused on the replica while the primary keeps writing, until its
+lag passes DB_REPLICA_MAX_LAG, then resumed.
+"""
+import argparse
+import asyncio
+import os
+import time
+from benchmarks import settings
+
+settings.apply()
+os.environ.setdefault('DB_REPLICA_URLS', 'localhost:5434')
+
+from sqlalchemy import text  # noqa: E402
+from benchmarks.common import report, summarize  # noqa: E402
+from utils import db  # noqa: E402
+from utils.db_replicas import new_read_session, replica_set  # noqa: E402
+
+
+async def reads(count: int) -> dict:
+    # pg_is_in_recovery() tells which server answered
+    targets = {'replica': 0, 'primary': 0}
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(count):
+        read_started = time.perf_counter()
+        async with new_read_session() as session:
+            in_recovery = (await session.execute(text("SELECT pg_is_in_recovery()"))).scalar()
+        latencies.append(time.perf_counter() - read_started)
+        targets['replica' if in_recovery else 'primary'] += 1
+    return {'targets': targets, 'latency': summarize(latencies, time.perf_counter() - started)}
+
+
+async def wait_until(predicate, timeout: float = 30) -> float:
+    started = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError("Replica routing did not change in time")
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def write_until(stop: asyncio.Event):
+    async with db.new_session() as session:
+        await session.execute(text("CREATE TABLE IF NOT EXISTS replica_bench (at float8)"))
+        await session.commit()
+        while not stop.is_set():
+            await session.execute(text("INSERT INTO replica_bench VALUES (:at)"),
+                                  {'at': time.time()})
+            await session.commit()
+            await asyncio.sleep(0.05)
+
+
+async def main(count: int):
+    replica = replica_set.replicas[0]
+    replica_set.start()
+    results = {'max_lag': replica_set.max_lag, 'check_interval': replica_set.check_interval}
+    results['seconds_to_first_check'] = await wait_until(lambda: replica_set.pick() is not None)
+    results['caught_up'] = await reads(count)
+
+    stop = asyncio.Event()
+    writer = asyncio.create_task(write_until(stop))
+    async with replica.engine.connect() as connection:
+        await connection.execute(text("SELECT pg_wal_replay_pause()"))
+        await connection.commit()
+        try:
+            results['seconds_to_primary_fallback'] = await wait_until(
+                lambda: replica_set.pick() is None)
+            results['replica_lag'] = replica.lag
+            results['lagging'] = await reads(count)
+        finally:
+            await connection.execute(text("SELECT pg_wal_replay_resume()"))
+            await connection.commit()
+    stop.set()
+    await writer
+
+    results['seconds_to_replica_again'] = await wait_until(lambda: replica_set.pick() is not None)
+    results['recovered'] = await reads(count)
+    report(results)
+
+    async with db.new_session() as session:
+        await session.execute(text("DROP TABLE replica_bench"))
+        await session.commit()
+    await replica_set.stop()
+    await db.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reads', type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.reads))
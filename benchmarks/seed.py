@@ -0,0 +1,55 @@
+from sqlalchemy import delete, insert, text
+from database.session_store import KEY_PREFIX as SESSIONS_PREFIX
+from models import items_models, users_models
+from utils import db
+from utils.items_cache import invalidate_items
+from utils.redis_connection import get_redis
+from utils.password_hashing import hash_password
+
+BENCH_USER_PREFIX = 'bench-user-'
+BENCH_ADMIN = 'bench-admin'
+BENCH_PASSWORD = 'bench-password'
+
+
+def bench_username(index: int) -> str:
+    return f'{BENCH_USER_PREFIX}{index}'
+
+
+async def seed(users: int, items: int, batch_size: int = 10000):
+    # Recreates the benchmark users and the items table. Refuses to run
+    # against a database that is not a benchmark one, items are truncated.
+    if not db.db_database.startswith('bench'):
+        raise RuntimeError(
+            f"Refusing to seed database {db.db_database!r}, its name must start with 'bench'")
+
+    db.create_schema()
+
+    User = users_models.User
+    Item = items_models.Item
+    # Every seeded user shares one hash, bcrypt would dominate seeding
+    password_hash = await hash_password(BENCH_PASSWORD)
+
+    async with db.new_session() as session:
+        await session.execute(delete(User).where(
+            User.username.like(f'{BENCH_USER_PREFIX}%') | (User.username == BENCH_ADMIN)))
+        await session.execute(text('TRUNCATE items RESTART IDENTITY'))
+
+        await session.execute(insert(User), [
+            {'username': BENCH_ADMIN, 'password_hash': password_hash, 'role': 'admin', 'tokens': []}])
+        for start in range(0, users, batch_size):
+            await session.execute(insert(User), [
+                {'username': bench_username(i), 'password_hash': password_hash,
+                 'role': 'user', 'tokens': []}
+                for i in range(start, min(users, start + batch_size))])
+        for start in range(0, items, batch_size):
+            await session.execute(insert(Item), [
+                {'name': f'item-{i}', 'quantity': i % 1000}
+                for i in range(start, min(items, start + batch_size))])
+
+        await session.commit()
+
+    # Sessions left by earlier runs would hit the per-user session cap
+    stale = [key async for key in get_redis().scan_iter(match=f'{SESSIONS_PREFIX}bench-*', count=1000)]
+    for start in range(0, len(stale), 1000):
+        await get_redis().delete(*stale[start:start + 1000])
+    await invalidate_items()
@@ -0,0 +1,80 @@
+"""Cost of turning a page of items into the JSON body of GET /items/, no
+database needed:
+
+    python -m benchmarks.serialization_bench --rows 10000 100000
+"""
+import argparse
+import json
+import time
+from typing import List
+from benchmarks import settings
+
+settings.apply()
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from benchmarks.common import report  # noqa: E402
+from models.items_models import Item  # noqa: E402
+from schemes import items_schemes  # noqa: E402
+from services.items_services import items_json  # noqa: E402
+
+ITEM_LIST = TypeAdapter(List[items_schemes.Item])
+
+
+def response_model(items, rows):
+    # Returning ORM objects through response_model: validation of every
+    # object, jsonable_encoder, then json.dumps
+    return json.dumps(jsonable_encoder(
+        ITEM_LIST.validate_python(items, from_attributes=True))).encode()
+
+
+def model_per_row(items, rows):
+    # Previous render_items_page
+    return json.dumps([items_schemes.Item.model_validate(item).model_dump()
+                       for item in items]).encode()
+
+
+def cached_adapter(items, rows):
+    return ITEM_LIST.dump_json(ITEM_LIST.validate_python(items, from_attributes=True))
+
+
+def row_tuples(items, rows):
+    # Current path: (id, name, quantity) rows to bytes
+    return items_json(rows)
+
+
+VARIANTS = (response_model, model_per_row, cached_adapter, row_tuples)
+
+
+def measure(variant, items, rows, runs: int) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        variant(items, rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(sizes: list, runs: int):
+    results = {}
+    for size in sizes:
+        items = [Item(id=i, name=f'item-{i}', quantity=i % 1000) for i in range(size)]
+        # Rows of a column select unpack like these tuples
+        rows = [(i, f'item-{i}', i % 1000) for i in range(size)]
+        bodies = {variant.__name__: json.loads(variant(items, rows)) for variant in VARIANTS}
+        assert all(body == bodies['row_tuples'] for body in bodies.values())
+
+        timings = {variant.__name__: measure(variant, items, rows, runs) for variant in VARIANTS}
+        baseline = timings['response_model']
+        results[size] = {name: {'ms': round(seconds * 1000, 2),
+                                'speedup': round(baseline / seconds, 2)}
+                         for name, seconds in timings.items()}
+    report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    main(args.rows, args.runs)
@@ -0,0 +1,23 @@
+import os
+
+# Defaults pointing at the stand-ins of benchmarks/docker-compose.yml. They
+# only apply when the variable is not set already, so the same tools can run
+# against any environment.
+BENCH_ENV = {
+    'POSTGRES_USER': 'bench',
+    'POSTGRES_PASSWORD': 'bench',
+    'POSTGRES_DATABASE': 'bench',
+    'POSTGRES_HOST': 'localhost',
+    'POSTGRES_PORT': '5433',
+    'SECRET_KEY': 'bench-secret-key',
+    'ALGORITHM': 'HS256',
+    'ACCESS_TOKEN_EXPIRE_MINUTES': '15',
+    'REFRESH_TOKEN_EXPIRE_MINUTES': '60',
+    'API_KEY': 'bench-api-key',
+}
+
+
+def apply():
+    # Must run before anything imports utils.db or services.users_services
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
@@ -0,0 +1,77 @@
+"""Queries reaching Postgres when a burst of identical reads arrives at once,
+as after an items cache invalidation or for a popular admin lookup, with
+the single-flight layer off and on:
+
+    python -m benchmarks.single_flight_bench --concurrency 200 --bursts 20
+
+Only runs against a database whose name starts with 'bench', it is
+reseeded.
+"""
+import argparse
+import asyncio
+import time
+from benchmarks import settings
+
+settings.apply()
+
+from benchmarks.common import report, summarize  # noqa: E402
+from benchmarks.seed import BENCH_ADMIN, seed  # noqa: E402
+from database import items_crud, users_crud  # noqa: E402
+from utils import db  # noqa: E402
+
+FLIGHTS = (items_crud.items_page_flight, users_crud.user_flight)
+
+CALLS = {
+    'items_page': lambda session: items_crud.get_all_items(session, items_crud.ITEMS_PAGE_SIZE),
+    'admin_lookup': lambda session: users_crud.get_user(session, BENCH_ADMIN),
+}
+
+
+def select_count() -> int:
+    series = db.QUERY_SECONDS.series.get(('SELECT',))
+    return series[2] if series else 0
+
+
+async def burst(call, concurrency: int, latencies: list):
+    async def one():
+        started = time.perf_counter()
+        async with db.new_session() as session:
+            await call(session)
+        latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+
+
+async def measure(call, concurrency: int, bursts: int) -> dict:
+    latencies = []
+    queries = select_count()
+    started = time.perf_counter()
+    for _ in range(bursts):
+        await burst(call, concurrency, latencies)
+    elapsed = time.perf_counter() - started
+    return {'queries': select_count() - queries, 'calls': concurrency * bursts,
+            'latency': summarize(latencies, elapsed)}
+
+
+async def main(concurrency: int, bursts: int, items: int):
+    await seed(users=10, items=items)
+    # Opens the pool first so the first burst does not measure handshakes
+    await burst(CALLS['items_page'], 1, [])
+
+    results = {'concurrency': concurrency, 'bursts': bursts}
+    for mode in ('off', 'local'):
+        for flight in FLIGHTS:
+            flight.mode = mode
+        results[mode] = {name: await measure(call, concurrency, bursts)
+                         for name, call in CALLS.items()}
+    report(results)
+    await db.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--items', type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.bursts, args.items))
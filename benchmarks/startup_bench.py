@@ -0,0 +1,61 @@
+"""Time for a fresh worker process to import the app and finish the
+lifespan startup, each run in a new interpreter:
+
+    python -m benchmarks.startup_bench --runs 10
+    python -m benchmarks.startup_bench --runs 10 --prewarm
+
+Without --prewarm no Postgres or Redis is needed.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from benchmarks import settings
+from benchmarks.common import percentile, report
+
+# Runs in the child interpreter and prints its timings in seconds
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from benchmarks import settings
+settings.apply()
+import main
+imported = time.perf_counter()
+from benchmarks.asgi_client import lifespan
+
+async def start():
+    async with lifespan(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(start())
+print(json.dumps({'import': imported - started, 'startup': ready - imported}))
+"""
+
+
+def run_once(prewarm: bool) -> dict:
+    env = dict(os.environ, PREWARM_POOLS=str(prewarm))
+    output = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs: int, prewarm: bool):
+    settings.apply()
+    timings = [run_once(prewarm) for _ in range(runs)]
+    results = {'runs': runs, 'prewarm': prewarm}
+    for phase in ('import', 'startup'):
+        samples = [timing[phase] for timing in timings]
+        results[phase] = {
+            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+            'max_ms': round(max(samples) * 1000, 3),
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--prewarm', action='store_true')
+    args = parser.parse_args()
+    main(args.runs, args.prewarm)
@@ -1,8 +1,148 @@
+import json
+from collections import namedtuple
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from pydantic_core import to_json
+from sqlalchemy import func, select, text, true, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import items_models
 from schemes import items_schemes
+from utils import db as db_utils
+from utils import db_replicas
+from utils.single_flight import SingleFlight, fetch
 
-def get_all_items(db: Session):
-    items = db.query(items_models.Item).all()
-    return items
\ No newline at end of file
+# Page size of GET /items/ and the largest one a client may ask for
+ITEMS_PAGE_SIZE = 100
+ITEMS_MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip when streaming the whole table
+ITEMS_STREAM_BATCH_SIZE = 1000
+
+# Held from the sequence update of an upsert to its commit, so concurrent
+# loads move the sequence one after the other
+ITEMS_SEQUENCE_LOCK_ID = 0x6974656d73  # "items"
+
+# Rows of a page as another worker published them
+ItemRow = namedtuple('ItemRow', ('id', 'name', 'quantity'))
+
+# Identical page queries in flight at the same time, typically right after
+# the items cache is invalidated, run once
+items_page_flight = SingleFlight(
+    'items_page',
+    encode=lambda rows: to_json([tuple(row) for row in rows]),
+    decode=lambda body: [ItemRow(*row) for row in json.loads(body)])
+
+async def get_all_items(db: AsyncSession, limit: int = ITEMS_PAGE_SIZE, after_id: int = None):
+    # (id, name, quantity) rows, no ORM object is built for a listing
+    Item = items_models.Item
+    query = select(Item.id, Item.name, Item.quantity).order_by(Item.id).limit(limit)
+
+    # Keyset pagination: seek past the last id instead of using OFFSET
+    if after_id is not None:
+        query = query.where(Item.id > after_id)
+
+    return await fetch(items_page_flight, db, query, lambda result: result.all())
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+async def search_items(db: AsyncSession, q: str = None, match: str = 'prefix',
+                       min_quantity: int = None, max_quantity: int = None,
+                       sort: str = 'id', order: str = 'asc',
+                       limit: int = ITEMS_PAGE_SIZE, after: tuple = None):
+    # Every filter and sort is served by an index of migrations/001 and 004.
+    # Both matches ignore case. `after` is the (sort value, id) of the last
+    # row of the previous page. Returns (id, name, quantity) rows.
+    Item = items_models.Item
+    column = {'id': Item.id, 'name': Item.name, 'quantity': Item.quantity}[sort]
+    query = select(Item.id, Item.name, Item.quantity)
+
+    if q:
+        if match == 'substring':
+            query = query.where(Item.name.ilike(f"%{escape_like(q)}%", escape='\\'))
+        else:
+            query = query.where(
+                func.lower(Item.name).like(f"{escape_like(q.lower())}%", escape='\\'))
+    if min_quantity is not None:
+        query = query.where(Item.quantity >= min_quantity)
+    if max_quantity is not None:
+        query = query.where(Item.quantity <= max_quantity)
+
+    # NULL names and quantities sort after every value, as in the indexes.
+    # The row comparison never matches them, so a page that reaches them is
+    # completed by a second query over the NULL rows in id order.
+    if after is None:
+        conditions = [true()]
+    else:
+        value, after_id = after
+        keyset = tuple_(column, Item.id)
+        if order == 'asc':
+            conditions = ([column.is_(None) & (Item.id > after_id)] if value is None
+                          else [keyset > tuple_(value, after_id), column.is_(None)])
+        else:
+            conditions = ([column.is_(None) & (Item.id < after_id), column.isnot(None)]
+                          if value is None else [keyset < tuple_(value, after_id)])
+
+    if order == 'asc':
+        query = query.order_by(column.asc().nulls_last(), Item.id.asc())
+    else:
+        query = query.order_by(column.desc().nulls_first(), Item.id.desc())
+
+    rows = []
+    for condition in conditions:
+        result = await db.execute(query.where(condition).limit(limit - len(rows)))
+        rows.extend(result.all())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+async def stream_items(batch_size: int = ITEMS_STREAM_BATCH_SIZE):
+    # Yields lists of (id, name, quantity) rows read from a server-side
+    # cursor, so memory stays constant whatever the size of the table. The
+    # session is owned here because it must live as long as the stream.
+    Item = items_models.Item
+    query = (select(Item.id, Item.name, Item.quantity)
+             .order_by(Item.id)
+             .execution_options(yield_per=batch_size))
+
+    async with db_replicas.new_read_session() as session:
+        result = await session.stream(query)
+        async for rows in result.partitions(batch_size):
+            yield rows
+
+
+async def copy_items(rows: list):
+    # Loads (name, quantity) tuples with COPY, the fastest path into
+    # Postgres. asyncpg is used directly because SQLAlchemy has no COPY.
+    async with db_utils.get_async_engine().connect() as connection:
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            items_models.Item.__tablename__, records=rows, columns=['name', 'quantity'])
+    return len(rows)
+
+
+async def upsert_items(rows: list):
+    # Multi-row INSERT ... ON CONFLICT (id) DO UPDATE of dicts with id,
+    # name and quantity
+    Item = items_models.Item
+    query = insert(Item).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[Item.id],
+        set_={'name': query.excluded.name, 'quantity': query.excluded.quantity})
+
+    async with db_utils.new_session() as session:
+        await session.execute(query)
+        # Explicit ids bypass the sequence, move it past them so later
+        # inserts do not collide. Never backwards: under the lock MAX(id)
+        # sees the rows of loads that went before, and the current value
+        # covers ids handed out meanwhile.
+        await session.execute(select(func.pg_advisory_xact_lock(ITEMS_SEQUENCE_LOCK_ID)))
+        await session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('items', 'id'), GREATEST("
+            "(SELECT MAX(id) FROM items), "
+            "(SELECT last_value FROM pg_sequences WHERE format('%I.%I', schemaname, sequencename)"
+            "::regclass = pg_get_serial_sequence('items', 'id')::regclass), 1))"))
+        await session.commit()
+    return len(rows)
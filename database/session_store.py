@@ -0,0 +1,120 @@
+import hashlib
+import math
+import time
+from decouple import config
+from database import users_crud
+from utils import db
+from utils.redis_connection import get_redis, run_script
+
+# Where refresh-token sessions live: "redis" (default) or "database" for the
+# legacy users.tokens JSONB column
+SESSION_STORE = config('SESSION_STORE', default='redis')
+
+# Sessions a user may have open at the same time
+MAX_SESSIONS = users_crud.MAX_SESSIONS
+
+KEY_PREFIX = "sessions:"
+
+# One sorted set per user: member = token digest, score = expiry timestamp.
+# Expired members are dropped before the cap is checked and the key itself
+# expires with its longest-lived session.
+#
+# KEYS[1] = sessions key
+# ARGV    = current time, expiry of the new token, max sessions, token digest
+ADD_SESSION_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(last[2])))
+return 1
+"""
+
+ADD_SESSION_SHA = hashlib.sha1(ADD_SESSION_SCRIPT.encode()).hexdigest()
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RedisSessionStore:
+    async def add(self, username: str, token: str, ttl: int) -> bool:
+        now = time.time()
+        added = await run_script(
+            ADD_SESSION_SHA, ADD_SESSION_SCRIPT, [f"{KEY_PREFIX}{username}"],
+            [now, now + ttl, MAX_SESSIONS, token_digest(token)])
+        return added == 1
+
+    async def exists(self, username: str, token: str) -> bool:
+        expires_at = await get_redis().zscore(f"{KEY_PREFIX}{username}", token_digest(token))
+        return expires_at is not None and expires_at > time.time()
+
+    async def remove(self, username: str, token: str):
+        await get_redis().zrem(f"{KEY_PREFIX}{username}", token_digest(token))
+
+    async def remove_all(self, username: str):
+        await get_redis().delete(f"{KEY_PREFIX}{username}")
+
+
+class DatabaseSessionStore:
+    # Tokens kept in the users.tokens JSONB column; ttl is not used because
+    # the token's own exp claim is checked when it is decoded
+
+    async def add(self, username: str, token: str, ttl: int) -> bool:
+        async with db.new_session() as session:
+            if await users_crud.add_refresh_token(session, username, token) is not None:
+                return True
+            # At the cap: expired tokens may be holding the slots, the
+            # background sweep only passes from time to time
+            if await users_crud.remove_expired_refresh_tokens(session, username):
+                return await users_crud.add_refresh_token(session, username, token) is not None
+            return False
+
+    async def exists(self, username: str, token: str) -> bool:
+        async with db.new_session() as session:
+            return await users_crud.get_refresh_token(session, username, token) is not None
+
+    async def remove(self, username: str, token: str):
+        async with db.new_session() as session:
+            await users_crud.remove_refresh_token(session, username, token)
+
+    async def remove_all(self, username: str):
+        async with db.new_session() as session:
+            await users_crud.remove_all_refresh_tokens(session, username)
+
+
+session_store = DatabaseSessionStore() if SESSION_STORE == 'database' else RedisSessionStore()
+
+
+async def backfill_redis_sessions(batch_size: int = 1000) -> int:
+    # One-off copy of the refresh tokens in users.tokens into the sorted
+    # sets, so switching to the Redis store does not log everybody out. Run
+    # by `python manage.py migrate`. Expired tokens are skipped and a user
+    # keeps the MAX_SESSIONS latest expiring ones. Returns the tokens copied.
+    copied = 0
+    after_id = 0
+    while True:
+        async with db.new_session() as session:
+            rows = await users_crud.get_token_batch(session, after_id, batch_size)
+        if not rows:
+            return copied
+        after_id = rows[-1].id
+
+        now = time.time()
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for row in rows:
+                expiries = ((users_crud.token_expiry(token), token)
+                            for token in row.tokens if isinstance(token, str))
+                live = sorted(((expires_at, token) for expires_at, token in expiries
+                               if expires_at and expires_at > now), reverse=True)[:MAX_SESSIONS]
+                if not live:
+                    continue
+                key = f"{KEY_PREFIX}{row.username}"
+                pipe.zadd(key, {token_digest(token): expires_at for expires_at, token in live})
+                # Sessions opened since the deploy count towards the cap too
+                pipe.zremrangebyrank(key, 0, -MAX_SESSIONS - 1)
+                pipe.expireat(key, math.ceil(live[0][0]))
+                copied += len(live)
+            await pipe.execute()
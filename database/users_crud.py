@@ -1,100 +1,189 @@
+import base64
+import json
+import time
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import String, bindparam, cast, func, select, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import users_models
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from utils import db as db_utils
+from utils import db_replicas
+from utils.single_flight import SingleFlight, fetch
+from utils.password_hashing import hash_password
+
+# Refresh tokens a user may hold at the same time
+MAX_SESSIONS = 5
+
+# Lookups of the same user in flight at the same time run once. Without an
+# encoder it stays local to the worker whatever SINGLE_FLIGHT_MODE says: the
+# row holds the password hash and the refresh tokens, which never go to Redis.
+user_flight = SingleFlight('user')
+
+# Rows read per query when exporting the users table
+USERS_EXPORT_BATCH_SIZE = 5000
+
+
+def token_expiry(token: str):
+    # exp claim of a JWT read straight from its payload, without checking the
+    # signature: only used to throw tokens away, never to accept one
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
 
 
-def get_user(db: Session, username: str):
-    User = users_models.User
-    user = db.query(User).filter(User.username == username).first()
-    return user
+def expired_tokens(tokens: list, now: float = None) -> list:
+    # Tokens past their exp, or unreadable ones which cannot be valid either
+    now = now or time.time()
+    return [token for token in tokens or []
+            if isinstance(token, str) and (token_expiry(token) or 0) <= now]
 
 
-def create_user(db: Session, user: dict):
+async def get_user(db: AsyncSession, username: str):
     User = users_models.User
-    username = user.get('username')
-    password = user.get('password')
-    tokens = user.get('tokens')
-    role = user.get('role') or None
+    return await fetch(user_flight, db, select(User).filter(User.username == username),
+                       lambda result: result.scalars().first())
 
-    user_in_db = db.query(User).filter(User.username == username).first()
 
-    if user_in_db:
+async def create_user(db: AsyncSession, user: dict):
+    # One INSERT: the unique index on username settles concurrent sign-ups
+    # and RETURNING replaces the refresh. Taken names are turned away before
+    # the hash, so retried sign-ups do not use up the hashing workers.
+    User = users_models.User
+    taken = await db.execute(select(User.id).where(User.username == user.get('username')))
+    if taken.first() is not None:
         raise HTTPException(status_code=400, detail="Username already taken")
 
-    password_hash = pwd_context.hash(password)
+    password_hash = await hash_password(user.get('password'))
 
-    db_user = User(username=username, password_hash=password_hash,
-                   tokens=tokens, role=role)
+    result = await db.execute(
+        insert(User)
+        .values(username=user.get('username'), password_hash=password_hash,
+                tokens=user.get('tokens') or [], role=user.get('role') or None)
+        .on_conflict_do_nothing(index_elements=[User.username])
+        .returning(User.id, User.username, User.role))
+    db_user = result.first()
+    await db.commit()
 
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Username already taken")
     return db_user
 
 
-def get_refresh_token(db: Session, username: str, refresh_token: str):
+async def get_refresh_token(db: AsyncSession, username: str, refresh_token: str):
+    # tokens @> '["<token>"]'
     User = users_models.User
-
-    # Query to retrieve the user's tokens
-    user_record = db.query(User).filter(User.username == username).first()
-
-    # Check if the user exists and has the specified refresh token
-    if user_record and refresh_token in user_record.tokens:
+    result = await db.execute(
+        select(User.id).where(User.username == username,
+                              User.tokens.contains([refresh_token])))
+    if result.first() is not None:
         return refresh_token
 
 
-def add_refresh_token(db: Session, username: str, new_refresh_token: str):
+async def add_refresh_token(db: AsyncSession, username: str, new_refresh_token: str):
+    # Appends the token only while the user is under the session cap, in a
+    # single statement so concurrent logins cannot go past it. No row back
+    # means the cap is reached (or no such user).
     User = users_models.User
-
-    # Retrieve the user record
-    user_record = db.query(User).filter(User.username == username).first()
-
-    if len(user_record.tokens) >= 5:
-        # Block the user from logging in
-        return None
-    # Append the new token to the user's tokens list
-    if user_record.tokens is None:
-        user_record.tokens = [new_refresh_token]
-    else:
-        user_record.tokens.append(new_refresh_token)
-
-    # Commit the changes to the database
-    db.commit()
-    db.refresh(user_record)
-
-    return new_refresh_token
-
-
-def remove_refresh_token(db: Session, username: str, refresh_token: str):
+    tokens = func.coalesce(User.tokens, cast([], User.tokens.type))
+    result = await db.execute(
+        update(User)
+        .where(User.username == username, func.jsonb_array_length(tokens) < MAX_SESSIONS)
+        .values(tokens=tokens.op('||')(cast([new_refresh_token], User.tokens.type)))
+        .returning(User.id)
+        .execution_options(synchronize_session=False))
+    added = result.first() is not None
+    await db.commit()
+
+    if added:
+        return new_refresh_token
+
+
+async def remove_refresh_token(db: AsyncSession, username: str, refresh_token: str):
+    # jsonb - text drops the matching string elements
     User = users_models.User
-
-    # Retrieve the user record
-    user_record = db.query(User).filter(User.username == username).first()
-
-    # Remove the token from the user's tokens list
-    user_record.tokens.remove(refresh_token)
-
-    # Commit the changes to the database
-    db.commit()
-    db.refresh(user_record)
+    await db.execute(
+        update(User)
+        .where(User.username == username)
+        .values(tokens=User.tokens.op('-')(cast(refresh_token, String)))
+        .execution_options(synchronize_session=False))
+    await db.commit()
 
     return refresh_token
 
 
-def remove_all_refresh_tokens(db: Session, username: str):
+async def get_token_batch(db, after_id: int = 0, limit: int = 1000):
+    # (id, username, tokens) of the next users holding tokens, in id order
     User = users_models.User
+    result = await db.execute(
+        select(User.id, User.username, User.tokens)
+        .where(User.id > after_id, func.jsonb_array_length(User.tokens) > 0)
+        .order_by(User.id)
+        .limit(limit))
+    return result.all()
+
+
+async def remove_tokens(db, expired: dict):
+    # {user id: tokens to drop} as one executemany UPDATE. jsonb - text[]
+    # removes just those tokens, so logins appending a token meanwhile keep it.
+    if not expired:
+        return
+    users = users_models.User.__table__
+    await db.execute(
+        update(users)
+        .where(users.c.id == bindparam('user_id'))
+        .values(tokens=users.c.tokens.op('-')(bindparam('expired', type_=ARRAY(String)))),
+        [{'user_id': user_id, 'expired': tokens} for user_id, tokens in expired.items()])
+    await db.commit()
+
+
+async def remove_expired_refresh_tokens(db: AsyncSession, username: str) -> int:
+    # Frees the session slots of one user held by expired tokens
+    User = users_models.User
+    result = await db.execute(select(User.id, User.tokens).where(User.username == username))
+    row = result.first()
+    expired = expired_tokens(row.tokens) if row else []
+    if expired:
+        await remove_tokens(db, {row.id: expired})
+    return len(expired)
 
-    # Retrieve the user record
-    user_record = db.query(User).filter(User.username == username).first()
-
-    # Remove all tokens from the user's tokens list
-    user_record.tokens = []
-
-    # Commit the changes to the database
-    db.commit()
-    db.refresh(user_record)
 
-    return user_record.tokens
\ No newline at end of file
+async def remove_all_refresh_tokens(db: AsyncSession, username: str):
+    User = users_models.User
+    await db.execute(
+        update(User)
+        .where(User.username == username)
+        .values(tokens=[])
+        .execution_options(synchronize_session=False))
+    await db.commit()
+
+    return []
+
+
+async def export_users(roles: list = None, batch_size: int = USERS_EXPORT_BATCH_SIZE):
+    # Yields lists of (id, username, role) rows, never the password hash or
+    # the tokens. Each batch is its own keyset query (id > last id) whose
+    # connection goes back to the pool before the batch is yielded, so a
+    # slow download holds neither a connection nor an open snapshot, and
+    # memory is bounded by one batch. The rows of one batch arrive through a
+    # server-side cursor.
+    User = users_models.User
+    query = select(User.id, User.username, User.role).order_by(User.id).limit(batch_size)
+    if roles:
+        query = query.where(User.role.in_(roles))
+
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else query.where(User.id > last_id)
+        async with db_replicas.new_read_session() as session:
+            result = await session.stream(batch_query.execution_options(yield_per=batch_size))
+            rows = [row async for row in result]
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
@@ -0,0 +1,158 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import time
+from decouple import config
+
+logger = logging.getLogger('launcher')
+
+# Connections all workers of this host may open together, split evenly
+# between them. Postgres refuses connections past max_connections (100 by
+# default) and the other clients of the database need some too.
+DB_CONNECTION_BUDGET = config('DB_CONNECTION_BUDGET', default=80, cast=int)
+# Same for the connection pool of each Redis client (the main one and one
+# per rate limit node). Calls past a worker's share wait for a connection
+# (REDIS_POOL_TIMEOUT, RATE_LIMIT_REDIS_TIMEOUT for the rate limiter) rather
+# than fail, and a worker gets at least REDIS_MIN_CONNECTIONS.
+REDIS_CONNECTION_BUDGET = config('REDIS_CONNECTION_BUDGET', default=400, cast=int)
+REDIS_MIN_CONNECTIONS = config('REDIS_MIN_CONNECTIONS', default=32, cast=int)
+
+# A worker exits after this many requests (0 = never) and is replaced, so a
+# slow leak cannot grow forever. The jitter keeps workers from recycling at
+# the same time.
+WORKER_MAX_REQUESTS = config('WORKER_MAX_REQUESTS', default=0, cast=int)
+WORKER_MAX_REQUESTS_JITTER = config('WORKER_MAX_REQUESTS_JITTER', default=0, cast=int)
+# Seconds a worker has to finish its requests after SIGTERM
+WORKER_GRACEFUL_TIMEOUT = config('WORKER_GRACEFUL_TIMEOUT', default=30, cast=int)
+
+
+def cpu_count() -> int:
+    # CPUs this process may run on, which is what a container is given
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_sizes(workers: int, db_budget: int = DB_CONNECTION_BUDGET,
+               redis_budget: int = REDIS_CONNECTION_BUDGET) -> dict:
+    # Settings every worker reads at import, from the global budgets
+    db_per_worker = max(2, db_budget // workers)
+    pool_size = max(1, db_per_worker * 2 // 3)
+    return {
+        'DB_POOL_SIZE': pool_size,
+        'DB_MAX_OVERFLOW': db_per_worker - pool_size,
+        'REDIS_MAX_CONNECTIONS': max(REDIS_MIN_CONNECTIONS, redis_budget // workers),
+        # bcrypt threads, the CPUs are shared by the workers
+        'PASSWORD_POOL_WORKERS': max(1, cpu_count() // workers),
+    }
+
+
+def serve(uvicorn_config, sockets: list):
+    # Entry point of a worker process
+    import uvicorn
+    uvicorn.Server(uvicorn_config).run(sockets=sockets)
+
+
+class Launcher:
+    # Pre-forks `workers` uvicorn servers sharing one listening socket.
+    # Workers that exit (request limit reached or crash) are replaced, SIGTERM
+    # or SIGINT drains them: they stop accepting, finish the requests in
+    # flight and run the lifespan shutdown.
+
+    def __init__(self, workers: int, host: str, port: int, ssl: bool = False,
+                 max_requests: int = WORKER_MAX_REQUESTS,
+                 max_requests_jitter: int = WORKER_MAX_REQUESTS_JITTER,
+                 graceful_timeout: int = WORKER_GRACEFUL_TIMEOUT):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.processes = []
+        self.should_exit = False
+        # Workers are fresh interpreters, nothing opened here leaks into them
+        self.context = multiprocessing.get_context('spawn')
+
+    def uvicorn_config(self):
+        import uvicorn
+        from main import SSL_CERTFILE, SSL_KEYFILE
+
+        limit = None
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+        return uvicorn.Config(
+            'main:app', host=self.host, port=self.port,
+            ssl_certfile=SSL_CERTFILE if self.ssl else None,
+            ssl_keyfile=SSL_KEYFILE if self.ssl else None,
+            limit_max_requests=limit,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+
+    def start_worker(self, sockets: list):
+        process = self.context.Process(target=serve, args=(self.uvicorn_config(), sockets))
+        process.start()
+        logger.info("Started worker %s", process.pid)
+        return process
+
+    def handle_exit(self, signum, frame):
+        self.should_exit = True
+
+    def run(self):
+        sizes = pool_sizes(self.workers)
+        os.environ.update({key: str(value) for key, value in sizes.items()})
+        logger.info("Starting %s workers on %s:%s with %s", self.workers, self.host, self.port,
+                    ', '.join(f'{key}={value}' for key, value in sizes.items()))
+
+        sockets = [self.uvicorn_config().bind_socket()]
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        signal.signal(signal.SIGINT, self.handle_exit)
+
+        self.processes = [self.start_worker(sockets) for _ in range(self.workers)]
+        while not self.should_exit:
+            time.sleep(0.5)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self.should_exit:
+                    logger.info("Worker %s exited with %s, replacing it",
+                                process.pid, process.exitcode)
+                    self.processes[index] = self.start_worker(sockets)
+
+        self.drain()
+        for sock in sockets:
+            sock.close()
+
+    def drain(self):
+        logger.info("Draining %s workers", len(self.processes))
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        # Workers stop on their own once their requests are done
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, killing it", process.pid)
+                process.kill()
+                process.join()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    parser = argparse.ArgumentParser(description='Run the API with several worker processes')
+    parser.add_argument('--workers', type=int,
+                        default=config('WEB_CONCURRENCY', default=0, cast=int) or cpu_count())
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--ssl', action='store_true',
+                        help='Serve HTTPS with the certificate configured in main.py')
+    parser.add_argument('--max-requests', type=int, default=WORKER_MAX_REQUESTS)
+    parser.add_argument('--max-requests-jitter', type=int, default=WORKER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--graceful-timeout', type=int, default=WORKER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+    Launcher(args.workers, args.host, args.port, args.ssl, args.max_requests,
+             args.max_requests_jitter, args.graceful_timeout).run()
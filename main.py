@@ -1,16 +1,28 @@
+from contextlib import asynccontextmanager
+from decouple import config
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from utils.redis_connection import redis
-from routers import items_router, users_router, admin_router
+from routers import items_router, users_router, admin_router, metrics_router
 from middlewares.rate_limit_middleware import RateLimitMiddleware
-import ssl
+from middlewares.metrics_middleware import MetricsMiddleware
+from middlewares.compression_middleware import CompressionMiddleware
+from middlewares.concurrency_limit_middleware import ConcurrencyLimitMiddleware
+from database import session_store
+from services.token_sweeper import token_sweeper
+from utils import db
+from utils.db_replicas import replica_set
+from utils.rate_limit_policies import policy_table
+from utils.password_hashing import password_pool
+from utils.redis_connection import close_redis, get_redis
+from utils.redis_shards import rate_limit_redis
 
-app = FastAPI()
+# Open the database and Redis connections at startup instead of on the first
+# requests
+PREWARM_POOLS = config('PREWARM_POOLS', default=False, cast=bool)
 
-ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-ssl_context.load_cert_chain('./cert.pem', keyfile='./key.pem')
-
-app.add_middleware(RateLimitMiddleware)
+# Only read when the server is started with `python main.py`
+SSL_CERTFILE = config('SSL_CERTFILE', default='./cert.pem')
+SSL_KEYFILE = config('SSL_KEYFILE', default='./key.pem')
 
 origins = [
     "http://localhost.tiangolo.com",
@@ -19,29 +31,65 @@ origins = [
     "http://localhost:8080",
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pools are opened lazily by the first request that needs them; the
+    # schema is created with `python manage.py create-schema`
+    if PREWARM_POOLS:
+        await db.prewarm()
+        await get_redis().ping()
+    replica_set.start()
+    # Redis expires its sessions itself, users.tokens only fills up when it
+    # is the store
+    if session_store.SESSION_STORE == 'database':
+        token_sweeper.start()
+    yield
+    await token_sweeper.stop()
+    await replica_set.stop()
+    # Push counts admitted locally in hybrid mode before the connection goes
+    await policy_table.stop()
+    await rate_limit_redis.close()
+    await close_redis()
+    await db.dispose()
+    password_pool.shutdown()
 
 
-@app.on_event("startup")
-async def startup():
-    redis
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
 
+    # Each add_middleware wraps the previous ones, requests go through
+    # Metrics -> Compression -> CORS -> RateLimit -> ConcurrencyLimit -> routes.
+    # Rejected requests still get CORS headers so browsers can read the
+    # 429/503. Clients over their rate limit are turned away before they
+    # take an in-flight slot, and the latency the concurrency limiter
+    # adapts to is the application's alone.
+    app.add_middleware(ConcurrencyLimitMiddleware)
+    app.add_middleware(RateLimitMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Outside CORS and the limiter so it compresses whatever they send back,
+    # with their headers already final
+    app.add_middleware(CompressionMiddleware)
+    # Added last so it is the outermost layer and also sees rejected requests
+    app.add_middleware(MetricsMiddleware)
 
-@app.on_event("shutdown")
-async def shutdown():
-    await redis.close()
+    app.include_router(admin_router.router)
+    app.include_router(items_router.router)
+    app.include_router(users_router.router)
+    app.include_router(metrics_router.router)
+    return app
 
 
-app.include_router(admin_router.router)
-app.include_router(items_router.router)
-app.include_router(users_router.router)
+# For `uvicorn main:app`, building the app opens no connection
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000, ssl=ssl_context)
+    uvicorn.run(app, host="0.0.0.0", port=5000,
+                ssl_certfile=SSL_CERTFILE, ssl_keyfile=SSL_KEYFILE)
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import logging
+from utils import db
+from utils.migrations import apply_migrations
+
+
+def create_schema(args):
+    db.create_schema()
+    print("Schema created")
+
+
+def migrate(args):
+    applied = apply_migrations()
+    print(f"Applied {len(applied)} migration(s): {', '.join(applied) or 'none'}")
+
+
+def sweep_tokens(args):
+    from services.token_sweeper import token_sweeper
+
+    async def run():
+        try:
+            return await token_sweeper.sweep()
+        finally:
+            await db.dispose()
+
+    result = asyncio.run(run())
+    print(result if result is not None else "Another process is sweeping")
+
+
+COMMANDS = {
+    'create-schema': (create_schema, 'Create the tables of the models that do not exist yet'),
+    'migrate': (migrate, 'Apply the pending SQL files of migrations/'),
+    'sweep-tokens': (sweep_tokens, 'Remove expired refresh tokens from users.tokens now'),
+}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Database maintenance commands')
+    commands = parser.add_subparsers(dest='name', required=True)
+    for name, (command, help_text) in COMMANDS.items():
+        commands.add_parser(name, help=help_text).set_defaults(handler=command)
+    args = parser.parse_args()
+    args.handler(args)
@@ -0,0 +1,100 @@
+import zlib
+from time import perf_counter
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from utils import metrics
+from utils.compression import (
+    COMPRESSION_LEVEL, COMPRESSION_MIN_SIZE, accepts_gzip, add_vary, compressible, gzip_etag)
+
+COMPRESSION_SECONDS = metrics.histogram(
+    'http_compression_duration_seconds', 'CPU time spent gzipping responses')
+COMPRESSION_BYTES = metrics.counter(
+    'http_compression_bytes_total', 'Response bytes before and after gzip', ('stage',))
+
+
+class CompressionMiddleware:
+    # gzips text responses for clients that accept it. Complete bodies under
+    # COMPRESSION_MIN_SIZE are left alone, streamed bodies are compressed
+    # chunk by chunk and flushed after each one so the client keeps getting
+    # data as it is produced. Responses that already carry a
+    # Content-Encoding (pre-compressed cached pages) pass through.
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE,
+                 level: int = COMPRESSION_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        gzip_ok = accepts_gzip(Headers(scope=scope).get('accept-encoding'))
+        start = None      # http.response.start held until the first body part
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            if compressor is None:
+                start['headers'] = list(start.get('headers', []))
+                headers = MutableHeaders(raw=start['headers'])
+                eligible = (compressible(headers.get('content-type', ''))
+                            and 'content-encoding' not in headers
+                            and start['status'] not in (204, 304))
+                if eligible:
+                    # The body depends on Accept-Encoding, caches must know
+                    add_vary(headers, 'Accept-Encoding')
+                if not eligible or not gzip_ok or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers['Content-Encoding'] = 'gzip'
+                del headers['Content-Length']
+                if 'etag' in headers:
+                    # Not the bytes the handler tagged, same suffix as the
+                    # pre-compressed item pages
+                    headers['ETag'] = gzip_etag(headers['etag'])
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # gzip container
+                if not more_body:
+                    # Whole body at once, it gets a Content-Length again
+                    compressed = self._compress(compressor, body, zlib.Z_FINISH)
+                    headers['Content-Length'] = str(len(compressed))
+                    await send(start)
+                    await send({'type': 'http.response.body', 'body': compressed})
+                    return
+                await send(start)
+
+            mode = zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH
+            await send({'type': 'http.response.body',
+                        'body': self._compress(compressor, body, mode),
+                        'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _compress(compressor, body: bytes, mode: int) -> bytes:
+        started = perf_counter()
+        compressed = compressor.compress(body) + compressor.flush(mode)
+        COMPRESSION_SECONDS.observe(perf_counter() - started)
+        COMPRESSION_BYTES.inc('in', amount=len(body))
+        COMPRESSION_BYTES.inc('out', amount=len(compressed))
+        return compressed
@@ -0,0 +1,36 @@
+from time import perf_counter
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Scope, Receive, Send
+from utils.concurrency_limits import ConcurrencyGroups, concurrency_groups
+
+# Clients are told to come back soon, the overload is usually short
+RETRY_AFTER = '1'
+
+
+class ConcurrencyLimitMiddleware:
+    def __init__(self, app: ASGIApp, groups: ConcurrencyGroups = concurrency_groups):
+        self.app = app
+        self.groups = groups
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.groups.match(scope['path'])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            response = PlainTextResponse(
+                "Server overloaded, try again later", status_code=503,
+                headers={"Retry-After": RETRY_AFTER})
+            await response(scope, receive, send)
+            return
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(perf_counter() - started)
@@ -0,0 +1,58 @@
+from time import perf_counter
+from starlette.types import ASGIApp, Scope, Receive, Send
+from utils import metrics
+
+REQUESTS = metrics.counter(
+    'http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('method', 'route'))
+IN_PROGRESS = metrics.gauge('http_requests_in_progress', 'HTTP requests being served')
+
+# Requests that never reached an endpoint (404, rejected by a middleware)
+# share one label value to keep the number of series bounded
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.route_paths = {}  # endpoint -> route path template
+        self.in_progress = 0
+
+    def route_path(self, scope: Scope) -> str:
+        # The router stores the matched endpoint in the scope, its path
+        # template is looked up once per endpoint
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self.route_paths.get(endpoint)
+        if path is None:
+            path = next((route.path for route in scope['app'].routes
+                         if getattr(route, 'endpoint', None) is endpoint), UNMATCHED_ROUTE)
+            self.route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = perf_counter()
+        self.in_progress += 1
+        IN_PROGRESS.set(self.in_progress)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.in_progress -= 1
+            IN_PROGRESS.set(self.in_progress)
+            route = self.route_path(scope)
+            REQUESTS.inc(scope['method'], route, str(status_code))
+            REQUEST_SECONDS.observe(perf_counter() - started, scope['method'], route)
@@ -1,22 +1,96 @@
+import hashlib
+import math
+from aioredis.exceptions import RedisError
+from jose import JWTError
 from starlette.types import ASGIApp, Scope, Receive, Send
+from starlette.requests import cookie_parser
 from starlette.responses import PlainTextResponse
-from utils.leaky_bucket import leaky_bucket
+from services.users_services import decode_access_token
+from utils import metrics
+from utils.circuit_breaker import CIRCUIT_OPEN_SECONDS, CircuitOpenError
+from utils.rate_limit_policies import PolicyTable, Rule, policy_table
+
+# The limiter could not reach Redis, the rule's on_error mode applies
+LIMITER_ERRORS = (RedisError, CircuitOpenError, OSError)
+
+FALLBACKS = metrics.counter(
+    'rate_limit_fallback_total', 'Requests decided without Redis by on_error mode',
+    ('rule', 'mode'))
+
+
+def client_ip(scope: Scope) -> str:
+    return scope["client"][0] if scope["client"] else "unknown"
+
+
+def header(scope: Scope, name: bytes):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def identity(rule: Rule, scope: Scope) -> str:
+    # What the rule limits; requests without a user or API key fall back to
+    # their IP
+    if rule.key == 'user':
+        cookies = header(scope, b'cookie')
+        access_token = cookie_parser(cookies).get('access_token') if cookies else None
+        if access_token:
+            try:
+                username = decode_access_token(access_token).get('sub')
+            except JWTError:
+                username = None
+            if username:
+                return f"user:{username}"
+    elif rule.key == 'api_key':
+        api_key = header(scope, b'x-api-key')
+        if api_key:
+            return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return f"ip:{client_ip(scope)}"
 
 
 class RateLimitMiddleware:
-    def __init__(self, app: ASGIApp):
+    def __init__(self, app: ASGIApp, policies: PolicyTable = policy_table):
         self.app = app
+        self.policies = policies
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
         if scope['type'] != 'http':
             await self.app(scope, receive, send)
             return
 
-        client_ip = scope["client"][0] if scope["client"] else "unknown"
+        rule = self.policies.match(scope['method'], scope['path'])
+        if rule is None or rule.limiter is None:
+            await self.app(scope, receive, send)
+            return
 
-        if not await leaky_bucket(client_ip):
+        key = identity(rule, scope)
+        try:
+            decision = await rule.limiter.check(key)
+        except LIMITER_ERRORS:
+            FALLBACKS.inc(rule.name, rule.on_error)
+            if rule.on_error == 'open':
+                await self.app(scope, receive, send)
+                return
+            if rule.on_error == 'closed':
+                response = PlainTextResponse(
+                    "Rate limiter unavailable", status_code=503,
+                    headers={"Retry-After": str(math.ceil(CIRCUIT_OPEN_SECONDS))})
+                await response(scope, receive, send)
+                return
+            decision = await rule.fallback.check(key)
+        headers = decision.headers()
+
+        if not decision.allowed:
             response = PlainTextResponse(
                 "Rate limit exceeded", status_code=429)
+            response.raw_headers.extend(headers)
             await response(scope, receive, send)
-        else:
-            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
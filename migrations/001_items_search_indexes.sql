@@ -0,0 +1,14 @@
+-- Indexes behind GET /items/search. CONCURRENTLY keeps the table writable
+-- while they build, so every statement runs outside a transaction.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- name LIKE 'prefix%' whatever the database collation
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_items_name_pattern ON items (name text_pattern_ops);
+
+-- name ILIKE '%substring%'
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_items_name_trgm ON items USING gin (name gin_trgm_ops);
+
+-- Quantity ranges and keyset pagination sorted by name or quantity
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_items_quantity_id ON items (quantity, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_items_name_id ON items (name, id);
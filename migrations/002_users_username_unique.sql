@@ -0,0 +1,10 @@
+-- Usernames are unique, registration inserts with ON CONFLICT (username)
+-- instead of checking first. The build fails if duplicates already exist,
+-- find them with:
+--   SELECT username FROM users GROUP BY username HAVING count(*) > 1
+-- then drop the INVALID index left behind before running it again.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_users_username ON users (username);
+
+-- Superseded by the unique index
+DROP INDEX CONCURRENTLY IF EXISTS ix_users_username;
@@ -0,0 +1,7 @@
+-- Prefix search ignores case like the substring one:
+-- lower(name) LIKE 'prefix%' whatever the database collation
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_items_name_lower_pattern
+    ON items (lower(name) text_pattern_ops);
+
+-- Superseded, nothing compares name with LIKE as it is anymore
+DROP INDEX CONCURRENTLY IF EXISTS ix_items_name_pattern;
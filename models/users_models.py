@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum
+from sqlalchemy import Column, Integer, String, Enum, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.mutable import MutableList
 from utils import db
@@ -8,10 +8,14 @@ Base = db.Base
 
 class User(Base):
     __tablename__ = 'users'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Also created by migrations/002_users_username_unique.sql
+        Index('ux_users_username', 'username', unique=True),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    username = Column(String, index=True)
+    username = Column(String)
     password_hash = Column(String)
     role = Column(Enum('admin', 'user', 'guest'), default='user')
     tokens = Column(MutableList.as_mutable(JSONB), default=[])
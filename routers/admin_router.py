@@ -1,10 +1,18 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+import csv
+import io
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
 from schemes import users_schemes
 from database import users_crud
-from sqlalchemy.orm import Session
-from utils import db
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils import db_replicas
 from services.users_services import check_admin_role
-from typing import List
+from services.token_sweeper import token_sweeper
+from typing import List, Literal, Optional
+from utils import items_cache
+from utils.password_hashing import password_pool
+from utils.token_cache import claims_cache
 
 router = APIRouter(
     prefix='/admin',
@@ -12,13 +20,66 @@ router = APIRouter(
 )
 
 
+@router.get('/export/users', status_code=status.HTTP_200_OK)
+async def export_users(fmt: Literal['ndjson', 'csv'] = Query('ndjson', alias='format'),
+                       role: Optional[List[Literal['admin', 'user', 'guest']]] = Query(None),
+                       current_user: dict = Depends(check_admin_role)):
+    # Streams id, username and role of every user, one batch at a time
+
+    async def ndjson():
+        async for rows in users_crud.export_users(role):
+            yield b''.join(
+                to_json({'id': user_id, 'username': username, 'role': user_role}) + b'\n'
+                for user_id, username, user_role in rows)
+
+    async def csv_rows():
+        yield 'id,username,role\r\n'
+        async for rows in users_crud.export_users(role):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            yield buffer.getvalue()
+
+    if fmt == 'csv':
+        content, media_type = csv_rows(), 'text/csv'
+    else:
+        content, media_type = ndjson(), 'application/x-ndjson'
+
+    return StreamingResponse(content, media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="users.{fmt}"'})
+
+
 @router.get('/{username}', response_model=users_schemes.FullUser, status_code=status.HTTP_200_OK)
-async def get_full_user(username: str, database: Session = Depends(db.get_db), current_user: dict = Depends(check_admin_role)):
+async def get_full_user(username: str, database: AsyncSession = Depends(db_replicas.get_read_db), current_user: dict = Depends(check_admin_role)):
 
-    user = users_crud.get_user(database, username)
+    user = await users_crud.get_user(database, username)
 
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     return user
+
+
+@router.get('/stats/password-pool', status_code=status.HTTP_200_OK)
+async def get_password_pool_stats(current_user: dict = Depends(check_admin_role)):
+    return password_pool.stats()
+
+
+@router.get('/stats/items-cache', status_code=status.HTTP_200_OK)
+async def get_items_cache_stats(current_user: dict = Depends(check_admin_role)):
+    return items_cache.stats
+
+
+@router.get('/stats/token-cache', status_code=status.HTTP_200_OK)
+async def get_token_cache_stats(current_user: dict = Depends(check_admin_role)):
+    return claims_cache.stats()
+
+
+@router.get('/stats/token-sweeper', status_code=status.HTTP_200_OK)
+async def get_token_sweeper_stats(current_user: dict = Depends(check_admin_role)):
+    return token_sweeper.stats()
+
+
+@router.get('/stats/replicas', status_code=status.HTTP_200_OK)
+async def get_replica_stats(current_user: dict = Depends(check_admin_role)):
+    return db_replicas.replica_set.stats()
@@ -1,10 +1,17 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
 from schemes import items_schemes
 from database import items_crud
-from sqlalchemy.orm import Session
-from utils import db
-from services.users_services import get_current_user
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils import db_replicas
+from utils import items_cache
+from utils.compression import accepts_gzip, gzip_etag
+from utils.pagination import decode_cursor, encode_cursor, is_int
+from utils.responses import RawJSONResponse
+from services.users_services import check_admin_role, get_current_user
+from services import items_services
+from typing import List, Literal, Optional
 
 router = APIRouter(
     prefix='/items',
@@ -12,8 +19,13 @@ router = APIRouter(
 )
 
 
-@router.get('/', response_model=List[items_schemes.Item], status_code=status.HTTP_200_OK)
-async def get_all_items(database: Session = Depends(db.get_db), current_user: dict = Depends(get_current_user)):
+@router.get('/', response_model=List[items_schemes.Item], response_class=RawJSONResponse,
+            status_code=status.HTTP_200_OK)
+async def get_all_items(request: Request,
+                        limit: int = Query(items_crud.ITEMS_PAGE_SIZE, ge=1,
+                                           le=items_crud.ITEMS_MAX_PAGE_SIZE),
+                        cursor: Optional[str] = None,
+                        database: AsyncSession = Depends(db_replicas.get_read_db), current_user: dict = Depends(get_current_user)):
     username = current_user.get("username")
     # Assuming you have a function to get user by username
 
@@ -21,5 +33,95 @@ async def get_all_items(database: Session = Depends(db.get_db), current_user: di
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
-    items = items_crud.get_all_items(database)
-    return items
+    after_id = decode_cursor(cursor).get('id') if cursor else None
+    if after_id is not None and not is_int(after_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    body, etag, next_cursor, gzipped = await items_services.get_items_page(
+        database, limit, cursor, after_id)
+
+    # Serve the cached gzip variant, CompressionMiddleware leaves encoded
+    # responses alone
+    headers = {'Vary': 'Accept-Encoding'}
+    if gzipped and accepts_gzip(request.headers.get('accept-encoding')):
+        body, etag = gzipped, gzip_etag(etag)
+        headers['Content-Encoding'] = 'gzip'
+    headers['ETag'] = etag
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+
+    if items_cache.etag_matches(request.headers.get('if-none-match'), etag):
+        items_cache.stats["not_modified"] += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # The body is already serialised, skip response_model validation
+    return RawJSONResponse(content=body, headers=headers)
+
+
+@router.get('/search', response_model=List[items_schemes.Item], response_class=RawJSONResponse,
+            status_code=status.HTTP_200_OK)
+async def search_items(q: Optional[str] = Query(None, min_length=1, max_length=100),
+                       match: Literal['prefix', 'substring'] = 'prefix',
+                       min_quantity: Optional[int] = None,
+                       max_quantity: Optional[int] = None,
+                       sort: Literal['id', 'name', 'quantity'] = 'id',
+                       order: Literal['asc', 'desc'] = 'asc',
+                       limit: int = Query(items_crud.ITEMS_PAGE_SIZE, ge=1,
+                                          le=items_crud.ITEMS_MAX_PAGE_SIZE),
+                       cursor: Optional[str] = None,
+                       database: AsyncSession = Depends(db_replicas.get_read_db), current_user: dict = Depends(get_current_user)):
+    if current_user.get("username") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    after = None
+    if cursor:
+        # A cursor is only valid for the sort it was issued for
+        values = decode_cursor(cursor)
+        value = values.get('value')
+        value_ok = isinstance(value, str) if sort == 'name' else is_int(value)
+        # Rows without a name or quantity give a null value
+        value_ok = value_ok or value is None and 'value' in values and sort != 'id'
+        if values.get('sort') != sort or values.get('order') != order \
+                or not value_ok or not is_int(values.get('id')):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        after = (values['value'], values['id'])
+
+    items = await items_crud.search_items(
+        database, q, match, min_quantity, max_quantity, sort, order, limit + 1, after)
+
+    headers = {}
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        headers['X-Next-Cursor'] = encode_cursor(
+            {'sort': sort, 'order': order, 'value': getattr(last, sort), 'id': last.id})
+
+    return RawJSONResponse(content=items_services.items_json(items), headers=headers)
+
+
+@router.get('/stream', status_code=status.HTTP_200_OK)
+async def stream_all_items(current_user: dict = Depends(get_current_user)):
+    if current_user.get("username") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    async def ndjson():
+        async for rows in items_crud.stream_items():
+            yield b''.join(
+                to_json({'id': item_id, 'name': name, 'quantity': quantity}) + b'\n'
+                for item_id, name, quantity in rows)
+
+    return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+
+
+@router.post('/bulk', response_model=items_schemes.BulkItemsReport, status_code=status.HTTP_200_OK)
+async def bulk_load_items(request: Request, mode: Literal['insert', 'upsert'] = 'insert',
+                          current_user: dict = Depends(check_admin_role)):
+    # NDJSON by default, CSV with a header row when the body is text/csv
+    content_type = request.headers.get('content-type', '')
+    fmt = 'csv' if 'csv' in content_type else 'ndjson'
+
+    return await items_services.ingest_items(request.stream(), fmt, mode)
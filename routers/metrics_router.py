@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from utils import metrics
+
+router = APIRouter(
+    tags=['Metrics']
+)
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
@@ -1,2 +1,4 @@
 uvicorn main:app --port 5000 --reload
 # uvicorn main:app --ssl-keyfile ./key.pem --ssl-certfile ./cert.pem --port 5000
+# One worker per CPU, connection pools split from DB_CONNECTION_BUDGET:
+# python launcher.py --port 5000 --ssl --max-requests 10000 --max-requests-jitter 1000
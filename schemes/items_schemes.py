@@ -1,18 +1,34 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, conint
+from typing import List, Optional
+
+# Range of the integer (int4) columns of the items table
+Int32 = conint(ge=-2**31, le=2**31 - 1)
 
 class BaseItem(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     name: str
     quantity: int
 
-    class Config():
-        orm_mode=True
-
 class Item(BaseItem):
     id: int
 
-    class Config():
-        orm_mode=True
-
 class ItemInput(BaseItem):
-    pass
+    quantity: Int32
+
+class ItemBulkInput(ItemInput):
+    # Rows of POST /items/bulk, the id is required by the upsert mode and
+    # rejected by the insert one
+    id: Optional[Int32] = None
+
+class BulkRowError(BaseModel):
+    line: int
+    error: str
 
+class BulkItemsReport(BaseModel):
+    rows: int
+    loaded: int
+    failed: int
+    seconds: float
+    rows_per_sec: float
+    errors: List[BulkRowError]
@@ -0,0 +1,180 @@
+import codecs
+import csv
+import json
+import time
+from asyncpg import InterfaceError, PostgresError
+from pydantic import ValidationError
+from pydantic_core import to_json
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import items_crud
+from schemes import items_schemes
+from utils import db as db_utils
+from utils import items_cache
+from utils.compression import gzip_body
+from utils.pagination import encode_cursor
+
+
+def items_json(rows) -> bytes:
+    # (id, name, quantity) rows straight to the JSON of List[items_schemes.Item],
+    # keys in the same order. The columns already have the scheme's types, so
+    # there is nothing to validate, and pydantic-core encodes the whole list
+    # in one call.
+    return to_json([{'name': name, 'quantity': quantity, 'id': item_id}
+                    for item_id, name, quantity in rows])
+
+
+async def render_items_page(db: AsyncSession, limit: int, after_id: int = None):
+    # One extra row tells whether there is a next page
+    items = await items_crud.get_all_items(db, limit + 1, after_id)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor({'id': items[-1].id})
+
+    return items_json(items), next_cursor
+
+
+async def get_items_page(db: AsyncSession, limit: int, cursor: str = None, after_id: int = None):
+    # Returns (body, etag, next_cursor, gzipped body or None). Pages are
+    # stored already serialised and compressed in Redis, so a hit costs
+    # neither a query, an encode nor a gzip.
+    version = await items_cache.get_version() if items_cache.ITEMS_CACHE_ENABLED else None
+
+    if version is not None:
+        key = items_cache.page_key(version, limit, cursor or '')
+        cached = await items_cache.get_page(key)
+        if cached:
+            return cached
+
+    if version is not None and await items_cache.recently_written():
+        # Read the write back from the primary, db may be a lagging replica
+        async with db_utils.new_session() as primary:
+            body, next_cursor = await render_items_page(primary, limit, after_id)
+    else:
+        body, next_cursor = await render_items_page(db, limit, after_id)
+    etag = items_cache.make_etag(body)
+    gzipped = gzip_body(body)
+
+    if version is not None:
+        await items_cache.set_page(key, body, etag, next_cursor, gzipped)
+
+    return body, etag, next_cursor, gzipped
+
+
+# Rows validated and loaded together, the body is never held in memory
+BULK_BATCH_SIZE = 5000
+# Row errors returned in the report, the rest are only counted
+BULK_MAX_REPORTED_ERRORS = 100
+# Errors that fail one batch and not the load: from the server, and from
+# asyncpg encoding the rows on the client (DataError is an InterfaceError
+# and a ValueError, out of range integers raise OverflowError)
+BATCH_ERRORS = (SQLAlchemyError, PostgresError, InterfaceError, ValueError, OverflowError)
+
+
+async def iter_lines(chunks):
+    # Yields (line number, text) from a stream of byte chunks
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    number = 0
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            number += 1
+            yield number, line.rstrip('\r')
+    buffer += decoder.decode(b'', final=True)
+    if buffer:
+        yield number + 1, buffer.rstrip('\r')
+
+
+async def iter_records(chunks, fmt: str):
+    # Yields (line number, dict or parse error message); CSV needs a header
+    # row and fields without embedded newlines
+    header = None
+    async for number, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        if fmt == 'csv':
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [column.strip() for column in values]
+                continue
+            if len(values) != len(header):
+                yield number, f"Expected {len(header)} fields, got {len(values)}"
+                continue
+            yield number, {column: value or None for column, value in zip(header, values)}
+        else:
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                yield number, f"Invalid JSON: {error}"
+                continue
+            if not isinstance(record, dict):
+                yield number, "Expected a JSON object"
+                continue
+            yield number, record
+
+
+async def ingest_items(chunks, fmt: str = 'ndjson', mode: str = 'insert') -> dict:
+    started = time.perf_counter()
+    report = {'rows': 0, 'loaded': 0, 'failed': 0, 'errors': []}
+
+    def reject(line: int, error: str):
+        report['failed'] += 1
+        if len(report['errors']) < BULK_MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': error})
+
+    async def load(batch: list):
+        # batch holds (line, row); a failing batch is reported row by row
+        if not batch:
+            return
+        try:
+            if mode == 'upsert':
+                # The last row wins when an id repeats within the batch
+                rows = {row.id: {'id': row.id, 'name': row.name, 'quantity': row.quantity}
+                        for _, row in batch}
+                await items_crud.upsert_items(list(rows.values()))
+            else:
+                await items_crud.copy_items([(row.name, row.quantity) for _, row in batch])
+        except BATCH_ERRORS as error:
+            message = str(error).splitlines()[0][:200]
+            for line, _ in batch:
+                reject(line, message)
+            return
+        report['loaded'] += len(batch)
+
+    batch = []
+    async for line, record in iter_records(chunks, fmt):
+        report['rows'] += 1
+        if isinstance(record, str):
+            reject(line, record)
+            continue
+        try:
+            row = items_schemes.ItemBulkInput.model_validate(record)
+        except ValidationError as error:
+            reject(line, '; '.join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}"
+                                   for e in error.errors()))
+            continue
+        if mode == 'upsert' and row.id is None:
+            reject(line, "id: required in upsert mode")
+            continue
+        if mode == 'insert' and row.id is not None:
+            # Loading it under a new id would duplicate the item
+            reject(line, "id: not allowed in insert mode, use mode=upsert")
+            continue
+
+        batch.append((line, row))
+        if len(batch) >= BULK_BATCH_SIZE:
+            await load(batch)
+            batch = []
+    await load(batch)
+
+    if report['loaded']:
+        await items_cache.invalidate_items()
+
+    seconds = time.perf_counter() - started
+    report['seconds'] = round(seconds, 3)
+    report['rows_per_sec'] = round(report['loaded'] / seconds, 1) if seconds else 0.0
+    return report
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import random
+import time
+from decouple import config
+from sqlalchemy import func, select
+from database import users_crud
+from utils import db, metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps of expired refresh tokens out of users.tokens,
+# 0 disables the background task
+TOKEN_SWEEP_INTERVAL = config('TOKEN_SWEEP_INTERVAL', default=3600, cast=float)
+TOKEN_SWEEP_BATCH_SIZE = config('TOKEN_SWEEP_BATCH_SIZE', default=1000, cast=int)
+# Upper bound on the users read per second, keeps the sweep from competing
+# with requests for the database
+TOKEN_SWEEP_ROWS_PER_SECOND = config('TOKEN_SWEEP_ROWS_PER_SECOND', default=5000, cast=float)
+
+# Held for the length of a sweep so only one worker sweeps at a time
+SWEEP_LOCK_ID = 0x746f6b656e73  # "tokens"
+
+SWEEP_SECONDS = metrics.histogram(
+    'token_sweep_duration_seconds', 'Duration of expired refresh token sweeps',
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+
+
+class TokenSweeper:
+    def __init__(self, interval: float = TOKEN_SWEEP_INTERVAL,
+                 batch_size: int = TOKEN_SWEEP_BATCH_SIZE,
+                 rows_per_second: float = TOKEN_SWEEP_ROWS_PER_SECOND):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.sweeps = 0
+        self.rows_scanned = 0
+        self.rows_updated = 0
+        self.tokens_removed = 0
+        self.last_sweep = None
+        self._task = None
+
+    async def sweep(self):
+        # One pass over the users holding tokens, in id order. Each batch is
+        # its own short transaction on a single connection, which also holds
+        # the advisory lock. Returns the summary, None if another worker is
+        # sweeping.
+        started = time.perf_counter()
+        scanned = updated = removed = 0
+        async with db.get_async_engine().connect() as conn:
+            locked = (await conn.execute(select(func.pg_try_advisory_lock(SWEEP_LOCK_ID)))).scalar()
+            await conn.commit()
+            if not locked:
+                return None
+            try:
+                after_id = 0
+                while True:
+                    batch_started = time.perf_counter()
+                    rows = await users_crud.get_token_batch(conn, after_id, self.batch_size)
+                    await conn.commit()
+                    if not rows:
+                        break
+                    after_id = rows[-1].id
+                    now = time.time()
+                    expired = {}
+                    for row in rows:
+                        tokens = users_crud.expired_tokens(row.tokens, now)
+                        if tokens:
+                            expired[row.id] = tokens
+                    await users_crud.remove_tokens(conn, expired)
+
+                    scanned += len(rows)
+                    updated += len(expired)
+                    removed += sum(len(tokens) for tokens in expired.values())
+                    if len(rows) < self.batch_size:
+                        break
+                    if self.rows_per_second > 0:
+                        await asyncio.sleep(max(0.0, len(rows) / self.rows_per_second
+                                                - (time.perf_counter() - batch_started)))
+            finally:
+                await conn.execute(select(func.pg_advisory_unlock(SWEEP_LOCK_ID)))
+                await conn.commit()
+
+        duration = time.perf_counter() - started
+        SWEEP_SECONDS.observe(duration)
+        self.sweeps += 1
+        self.rows_scanned += scanned
+        self.rows_updated += updated
+        self.tokens_removed += removed
+        self.last_sweep = {"finished_at": time.time(), "duration_seconds": duration,
+                           "rows_scanned": scanned, "rows_updated": updated,
+                           "tokens_removed": removed}
+        logger.info("Token sweep removed %d expired tokens from %d of %d users in %.2fs",
+                    removed, updated, scanned, duration)
+        return self.last_sweep
+
+    async def _run(self):
+        while True:
+            # Jittered so workers started together do not all wake at once
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Token sweep failed")
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "batch_size": self.batch_size,
+            "rows_per_second": self.rows_per_second,
+            "running": self._task is not None,
+            "sweeps": self.sweeps,
+            "rows_scanned_total": self.rows_scanned,
+            "rows_updated_total": self.rows_updated,
+            "tokens_removed_total": self.tokens_removed,
+            "last_sweep": self.last_sweep,
+        }
+
+    def samples(self):
+        return [
+            ('token_sweep_runs_total', 'counter', 'Completed expired token sweeps', self.sweeps),
+            ('token_sweep_rows_scanned_total', 'counter', 'Users read by token sweeps',
+             self.rows_scanned),
+            ('token_sweep_rows_updated_total', 'counter', 'Users rewritten by token sweeps',
+             self.rows_updated),
+            ('token_sweep_tokens_removed_total', 'counter', 'Expired refresh tokens removed',
+             self.tokens_removed),
+        ]
+
+
+token_sweeper = TokenSweeper()
+metrics.register_collector(token_sweeper.samples)
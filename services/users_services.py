@@ -1,15 +1,14 @@
 from fastapi import HTTPException, status, Depends, Response, Request, Header
 from fastapi.security import OAuth2PasswordBearer
 from database import users_crud
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from database.session_store import session_store
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta, datetime
 from typing import Optional
 from jose import JWTError, jwt
 from decouple import config
-from utils import db
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from utils.password_hashing import verify_password
+from utils.token_cache import claims_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -20,8 +19,8 @@ jwt_refresh_token_expires = config('REFRESH_TOKEN_EXPIRE_MINUTES')
 api_key = config('API_KEY')
 
 
-def get_user(db: Session, username: str):
-    return users_crud.get_user(db, username)
+async def get_user(db: AsyncSession, username: str):
+    return await users_crud.get_user(db, username)
 
 
 def create_jwt_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -33,18 +32,18 @@ def create_jwt_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def authenticate_user(username: str, password: str, db: Session):
-    user = get_user(db, username)
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await get_user(db, username)
 
-    if not user or not pwd_context.verify(password, user.password_hash):
+    if not user or not await verify_password(password, user.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Incorrect username or password")
 
     return user
 
 
-async def login(username: str, password: str, db: Session, response: Response = None):
-    user = authenticate_user(username, password, db)
+async def login(username: str, password: str, db: AsyncSession, response: Response = None):
+    user = await authenticate_user(username, password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -61,10 +60,10 @@ async def login(username: str, password: str, db: Session, response: Response =
         data={"sub": user.username, "role": user.role}, expires_delta=refresh_token_expires
     )
 
-    new_refresh_token = users_crud.add_refresh_token(
-        db, user.username, refresh_token)
+    session_added = await session_store.add(
+        user.username, refresh_token, int(refresh_token_expires.total_seconds()))
 
-    if not new_refresh_token:
+    if not session_added:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Maximum number of sessions reached",
@@ -97,6 +96,17 @@ async def login(username: str, password: str, db: Session, response: Response =
     return response_user
 
 
+def decode_access_token(access_token: str) -> dict:
+    # Clients re-send the same token until it expires, only the first
+    # request pays for the signature check
+    payload = claims_cache.get(access_token)
+    if payload is None:
+        payload = jwt.decode(access_token, jwt_secret_key,
+                             algorithms=[jwt_algorithm])
+        claims_cache.put(access_token, payload)
+    return payload
+
+
 async def get_current_user(request: Request, response: Response = None):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -109,8 +119,7 @@ async def get_current_user(request: Request, response: Response = None):
         if not access_token:
             raise JWTError("Missing access token")
 
-        payload = jwt.decode(access_token, jwt_secret_key,
-                             algorithms=[jwt_algorithm])
+        payload = decode_access_token(access_token)
         username: str = payload.get("sub")
         role: str = payload.get("role")
 
@@ -126,6 +135,7 @@ async def get_current_user(request: Request, response: Response = None):
         try:
             payload = jwt.decode(
                 new_access_token, jwt_secret_key, algorithms=[jwt_algorithm])
+            claims_cache.put(new_access_token, payload)
         except JWTError:
             raise credentials_exception
 
@@ -135,7 +145,17 @@ async def get_current_user(request: Request, response: Response = None):
     return {"username": username, "role": role}
 
 
-async def create_user(user: dict, db: Session, response: Response = None):
+async def start_session(username: str, refresh_token: str, expires: timedelta):
+    # The account exists at this point, only the session failed: the client
+    # gets no refresh cookie the store never saved and can log in instead
+    if not await session_store.add(username, refresh_token, int(expires.total_seconds())):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="User created but the session could not be started, log in",
+        )
+
+
+async def create_user(user: dict, db: AsyncSession, response: Response = None):
     role = user.get('role') or 'user'
 
     refresh_token_expires = timedelta(minutes=int(jwt_refresh_token_expires))
@@ -148,9 +168,12 @@ async def create_user(user: dict, db: Session, response: Response = None):
         data={"sub": user['username'], "role": role}, expires_delta=access_token_expires
     )
 
-    user['tokens'] = [refresh_token]
+    user['tokens'] = []
     user['role'] = role
 
+    user_in_db = await users_crud.create_user(db, user)
+    await start_session(user_in_db.username, refresh_token, refresh_token_expires)
+
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
@@ -167,8 +190,6 @@ async def create_user(user: dict, db: Session, response: Response = None):
         expires=60 * 5,
     )
 
-    user_in_db = users_crud.create_user(db, user)
-
     response_user = {
         "username": user_in_db.username,
         "role": user_in_db.role,
@@ -181,7 +202,6 @@ async def create_user(user: dict, db: Session, response: Response = None):
 
 async def generate_access_token_from_refresh_token(refresh_token: str, response: Response = None):
     print("test")
-    db_session = next(db.get_db())
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
@@ -196,9 +216,7 @@ async def generate_access_token_from_refresh_token(refresh_token: str, response:
         if username is None:
             raise credentials_exception
 
-        existent_refresh_token = users_crud.get_refresh_token(
-            db_session, username, refresh_token)
-        if not existent_refresh_token:
+        if not await session_store.exists(username, refresh_token):
             raise credentials_exception
 
         access_token_expires = timedelta(minutes=int(jwt_access_token_expires))
@@ -220,7 +238,7 @@ async def generate_access_token_from_refresh_token(refresh_token: str, response:
     return access_token
 
 
-async def logout(db: Session, request: Request = None, response: Response = None):
+async def logout(request: Request = None, response: Response = None):
     refresh_token = request.cookies.get('refresh_token')
 
     if not refresh_token:
@@ -234,7 +252,7 @@ async def logout(db: Session, request: Request = None, response: Response = None
                          algorithms=[jwt_algorithm])
 
     username: str = payload.get("sub")
-    users_crud.remove_refresh_token(db, username, refresh_token)
+    await session_store.remove(username, refresh_token)
 
     response.delete_cookie(key="refresh_token")
     response.delete_cookie(key="access_token")
@@ -252,7 +270,7 @@ async def check_admin_role(current_user: dict = Depends(get_current_user)):
     return True
 
 
-async def master_logout(db: Session, request: Request = None, response: Response = None):
+async def master_logout(request: Request = None, response: Response = None):
     refresh_token = request.cookies.get('refresh_token')\
 
     if not refresh_token:
@@ -267,7 +285,7 @@ async def master_logout(db: Session, request: Request = None, response: Response
 
     username: str = payload.get("sub")
 
-    users_crud.remove_all_refresh_tokens(db, username)
+    await session_store.remove_all(username)
 
     response.delete_cookie(key="refresh_token")
     response.delete_cookie(key="access_token")
@@ -275,12 +293,12 @@ async def master_logout(db: Session, request: Request = None, response: Response
     return True
 
 
-async def create_admin_user(user: dict, db: Session, response: Response = None):
+async def create_admin_user(user: dict, db: AsyncSession, response: Response = None):
     role = "admin"
 
-    refresh_toke_expires = timedelta(minutes=int(jwt_refresh_token_expires))
+    refresh_token_expires = timedelta(minutes=int(jwt_refresh_token_expires))
     refresh_token = create_jwt_token(
-        data={"sub": user['username'], "role": role}, expires_delta=refresh_toke_expires
+        data={"sub": user['username'], "role": role}, expires_delta=refresh_token_expires
     )
 
     access_token_expires = timedelta(minutes=int(jwt_access_token_expires))
@@ -288,9 +306,12 @@ async def create_admin_user(user: dict, db: Session, response: Response = None):
         data={"sub": user['username'], "role": role}, expires_delta=access_token_expires
     )
 
-    user['tokens'] = [refresh_token]
+    user['tokens'] = []
     user['role'] = role
 
+    user_in_db = await users_crud.create_user(db, user)
+    await start_session(user_in_db.username, refresh_token, refresh_token_expires)
+
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
@@ -307,8 +328,6 @@ async def create_admin_user(user: dict, db: Session, response: Response = None):
         expires=60 * 5,
     )
 
-    user_in_db = users_crud.create_user(db, user)
-
     response_user = {
         "username": user_in_db.username,
         "role": user_in_db.role,
@@ -0,0 +1,56 @@
+import asyncio
+import gzip
+from middlewares.compression_middleware import CompressionMiddleware
+
+BODY = b'{"items": []}' * 200
+
+
+def app_returning(headers, body=BODY):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(name.encode(), value.encode()) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+    return app
+
+
+def call(app, accept_encoding='gzip'):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'headers': [(b'accept-encoding', accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app)(scope, None, send))
+    start, body = messages
+    headers = {}
+    for name, value in start['headers']:
+        headers.setdefault(name.decode().lower(), []).append(value.decode())
+    return headers, body['body']
+
+
+def test_vary_is_not_repeated():
+    headers, _ = call(app_returning([('content-type', 'application/json'),
+                                     ('vary', 'Accept-Encoding')]), accept_encoding='identity')
+    assert headers['vary'] == ['Accept-Encoding']
+
+    headers, _ = call(app_returning([('content-type', 'application/json'),
+                                     ('vary', 'origin, accept-encoding')]))
+    assert headers['vary'] == ['origin, accept-encoding']
+
+
+def test_vary_is_appended_to_other_fields():
+    headers, _ = call(app_returning([('content-type', 'application/json'), ('vary', 'Origin')]))
+    assert headers['vary'] == ['Origin, Accept-Encoding']
+
+
+def test_gzipped_response_gets_its_own_etag():
+    headers, body = call(app_returning([('content-type', 'application/json'),
+                                        ('etag', '"abc"')]))
+    assert headers['content-encoding'] == ['gzip']
+    assert headers['etag'] == ['"abc-gzip"']
+    assert gzip.decompress(body) == BODY
+
+    headers, body = call(app_returning([('content-type', 'application/json'),
+                                        ('etag', '"abc"')]), accept_encoding='identity')
+    assert headers['etag'] == ['"abc"']
+    assert body == BODY
@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from routers import items_router
+from utils.pagination import encode_cursor
+
+USER = {'username': 'alice'}
+
+
+def get_items_page(cursor):
+    return asyncio.run(items_router.get_all_items(
+        request=None, limit=10, cursor=cursor, database=None, current_user=USER))
+
+
+@pytest.mark.parametrize('values', [{'id': True}, {'id': 'x'}, {'id': 1.5}])
+def test_items_page_rejects_non_integer_ids(values):
+    with pytest.raises(HTTPException) as raised:
+        get_items_page(encode_cursor(values))
+    assert raised.value.status_code == 400
+
+
+def search_page(sort, cursor):
+    return asyncio.run(items_router.search_items(
+        q=None, match='prefix', min_quantity=None, max_quantity=None, sort=sort, order='asc',
+        limit=10, cursor=cursor, database=None, current_user=USER))
+
+
+@pytest.mark.parametrize('sort, value, after_id', [
+    ('id', 5, True),
+    ('quantity', True, 5),
+    ('quantity', 'x', 5),
+    ('name', 5, 5),
+    ('id', None, 5),
+])
+def test_search_rejects_mistyped_cursor_values(sort, value, after_id):
+    cursor = encode_cursor({'sort': sort, 'order': 'asc', 'value': value, 'id': after_id})
+    with pytest.raises(HTTPException) as raised:
+        search_page(sort, cursor)
+    assert raised.value.status_code == 400
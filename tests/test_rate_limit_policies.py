@@ -0,0 +1,71 @@
+import pytest
+from utils.rate_limit_policies import DEFAULT_POLICIES, compile_policies
+from utils.rate_limiters import GCRALimiter, LeakyBucketLimiter, LocalLimiter
+
+
+@pytest.fixture
+def table():
+    return compile_policies(DEFAULT_POLICIES, mode='redis')
+
+
+def rule_name(table, method, path):
+    rule = table.match(method, path)
+    return rule and rule.name
+
+
+@pytest.mark.parametrize('method, path, expected', [
+    ('GET', '/', 'default'),
+    ('GET', '/unknown/path', 'default'),
+    ('GET', '/items', 'items'),
+    ('GET', '/items/', 'items'),
+    ('GET', '/items/search', 'items'),
+    ('POST', '/items/bulk', 'default'),
+    ('GET', '/itemsfoo', 'default'),
+    ('POST', '/users/authenticate', 'login'),
+    ('POST', '/users/authenticate/', 'login'),
+    ('POST', '/users/register', 'register'),
+    ('POST', '/users/create-admin', 'create-admin'),
+    ('GET', '/users/me', 'default'),
+    ('GET', '/metrics', 'metrics'),
+])
+def test_match_picks_the_longest_prefix(table, method, path, expected):
+    assert rule_name(table, method, path) == expected
+
+
+def test_method_specific_rule_wins_over_catch_all_on_the_same_prefix():
+    table = compile_policies([
+        {'name': 'any', 'prefix': '/items', 'algorithm': 'gcra', 'limit': 1, 'period': 1},
+        {'name': 'get', 'prefix': '/items', 'methods': ['get'], 'algorithm': 'gcra',
+         'limit': 1, 'period': 1},
+    ])
+    assert rule_name(table, 'GET', '/items/1') == 'get'
+    assert rule_name(table, 'DELETE', '/items/1') == 'any'
+    assert rule_name(table, 'GET', '/') is None
+
+
+def test_exempt_prefix_has_no_limiter(table):
+    assert table.match('GET', '/metrics').limiter is None
+
+
+def test_limiters_and_fallbacks(table):
+    items = table.match('GET', '/items')
+    assert isinstance(items.limiter, GCRALimiter)
+    assert isinstance(items.fallback, LocalLimiter)
+    assert (items.fallback.limit, items.fallback.period) == (100, 10.0)
+    assert isinstance(table.match('GET', '/').limiter, LeakyBucketLimiter)
+
+
+def test_on_error_open_has_no_fallback():
+    table = compile_policies([{'name': 'r', 'prefix': '/', 'algorithm': 'gcra', 'limit': 1,
+                               'period': 1, 'on_error': 'open'}])
+    assert table.match('GET', '/').fallback is None
+
+
+@pytest.mark.parametrize('policy', [
+    {'name': 'r', 'key': 'cookie', 'limit': 1, 'period': 1},
+    {'name': 'r', 'algorithm': 'token_bucket', 'limit': 1, 'period': 1},
+    {'name': 'r', 'on_error': 'retry', 'limit': 1, 'period': 1},
+])
+def test_invalid_policies_are_rejected(policy):
+    with pytest.raises(ValueError):
+        compile_policies([policy])
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from utils import rate_limiters
+from utils.rate_limiters import Decision, Limiter, LocalLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiters.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def check(limiter, identity='client'):
+    return asyncio.run(limiter.check(identity))
+
+
+def test_limiter_is_abstract():
+    with pytest.raises(TypeError):
+        Limiter('r', 1, 1)
+
+
+def test_local_limiter_allows_a_burst_of_limit_then_one_per_interval(clock):
+    # 5 per 10 s: one request every 2 s, bursts of 5
+    limiter = LocalLimiter('r', 5, 10)
+    decisions = [check(limiter) for _ in range(5)]
+    assert all(decision.allowed for decision in decisions)
+    assert [decision.remaining for decision in decisions] == [4, 3, 2, 1, 0]
+    assert decisions[0].reset_after == pytest.approx(2)
+    assert decisions[-1].reset_after == pytest.approx(10)
+
+    denied = check(limiter)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(2)
+    assert denied.reset_after == pytest.approx(10)
+
+    clock[0] += 1.9
+    assert not check(limiter).allowed
+    clock[0] += 0.1
+    allowed = check(limiter)
+    assert allowed.allowed
+    assert allowed.remaining == 0
+
+
+def test_local_limiter_recovers_fully_after_a_period(clock):
+    limiter = LocalLimiter('r', 5, 10)
+    for _ in range(5):
+        check(limiter)
+    clock[0] += 10
+    assert check(limiter).remaining == 4
+
+
+def test_local_limiter_counts_identities_apart(clock):
+    limiter = LocalLimiter('r', 1, 10)
+    assert check(limiter, 'a').allowed
+    assert not check(limiter, 'a').allowed
+    assert check(limiter, 'b').allowed
+
+
+def test_local_limiter_evicts_the_least_recently_seen(clock):
+    limiter = LocalLimiter('r', 1, 10, max_clients=2)
+    check(limiter, 'a')
+    check(limiter, 'b')
+    check(limiter, 'c')
+    assert list(limiter.tats) == ['b', 'c']
+    # An evicted client starts over
+    assert check(limiter, 'a').allowed
+
+
+def test_decision_headers():
+    allowed = dict(Decision(True, 10, 3, 4.2, 0.0, 10).headers())
+    assert allowed[b'ratelimit-remaining'] == b'3'
+    assert allowed[b'ratelimit-reset'] == b'5'
+    assert allowed[b'ratelimit-policy'] == b'10;w=10'
+    assert b'retry-after' not in allowed
+
+    denied = dict(Decision(False, 10, -1, 4.0, 0.2, 10).headers())
+    assert denied[b'ratelimit-remaining'] == b'0'
+    assert denied[b'retry-after'] == b'1'
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from aioredis.exceptions import ResponseError
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from utils.redis_shards import RedisShards
+
+URL = 'redis://node-a:6379/0'
+
+
+@pytest.fixture
+def shards():
+    shards = RedisShards([URL])
+    breaker = shards.breakers[URL]
+    breaker.half_open_calls = 1
+    # Open long enough ago that the next call is a half-open trial
+    breaker._transition(OPEN)
+    breaker.opened_at -= breaker.open_seconds + 1
+    return shards
+
+
+def failing(error):
+    async def operation(client):
+        raise error
+    return operation
+
+
+async def succeeding(client):
+    return 'ok'
+
+
+def call(shards, operation):
+    return asyncio.run(shards.call_node(URL, operation))
+
+
+def test_node_error_reopens_a_half_open_breaker(shards):
+    with pytest.raises(RedisConnectionError):
+        call(shards, failing(RedisConnectionError('down')))
+    assert shards.breakers[URL].state == OPEN
+
+
+@pytest.mark.parametrize('error', [ResponseError('BUSY'), asyncio.CancelledError(),
+                                   ValueError('bad reply')])
+def test_other_outcomes_give_the_trial_slot_back(shards, error):
+    breaker = shards.breakers[URL]
+    for _ in range(3):
+        with pytest.raises(type(error)):
+            call(shards, failing(error))
+        assert breaker.state == HALF_OPEN
+        assert breaker.available()
+
+    assert call(shards, succeeding) == 'ok'
+    assert breaker.state == CLOSED
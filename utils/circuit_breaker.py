@@ -0,0 +1,124 @@
+import logging
+import time
+from collections import deque
+from decouple import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# The breaker looks at the outcome of the last CIRCUIT_WINDOW calls and opens
+# once at least CIRCUIT_MIN_CALLS of them are known and CIRCUIT_FAILURE_RATE
+# of them failed. Failures are errors and timeouts (the socket deadline of
+# the caller). CIRCUIT_SLOW_CALL_SECONDS > 0 also counts successful calls
+# slower than that as failures; off by default because the latency measured
+# around an await includes event loop lag, and a CPU-bound worker would open
+# the breakers of healthy nodes. Keep it well above the socket deadline.
+CIRCUIT_WINDOW = config('CIRCUIT_WINDOW', default=20, cast=int)
+CIRCUIT_MIN_CALLS = config('CIRCUIT_MIN_CALLS', default=5, cast=int)
+CIRCUIT_FAILURE_RATE = config('CIRCUIT_FAILURE_RATE', default=0.5, cast=float)
+CIRCUIT_SLOW_CALL_SECONDS = config('CIRCUIT_SLOW_CALL_SECONDS', default=0.0, cast=float)
+# An open breaker refuses calls for this long, then lets trial calls through
+CIRCUIT_OPEN_SECONDS = config('CIRCUIT_OPEN_SECONDS', default=5.0, cast=float)
+CIRCUIT_HALF_OPEN_CALLS = config('CIRCUIT_HALF_OPEN_CALLS', default=2, cast=int)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = metrics.gauge(
+    'circuit_breaker_state', 'Circuit breaker state: 0 closed, 1 half open, 2 open',
+    ('breaker',))
+BREAKER_TRANSITIONS = metrics.counter(
+    'circuit_breaker_transitions_total', 'Circuit breaker state changes',
+    ('breaker', 'from_state', 'to_state'))
+BREAKER_REJECTED = metrics.counter(
+    'circuit_breaker_rejected_total', 'Calls refused by an open circuit breaker', ('breaker',))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Only touched from the event loop thread, no locking
+
+    def __init__(self, name: str, window: int = CIRCUIT_WINDOW,
+                 min_calls: int = CIRCUIT_MIN_CALLS,
+                 failure_rate: float = CIRCUIT_FAILURE_RATE,
+                 slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 half_open_calls: int = CIRCUIT_HALF_OPEN_CALLS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.outcomes = deque(maxlen=window)  # True for a failed (or slow) call
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trials = 0  # Calls let through while half open
+        self.trial_successes = 0
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], name)
+
+    def available(self) -> bool:
+        # Whether a call would be let through, without claiming a trial slot
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.open_seconds
+        if self.state == HALF_OPEN:
+            return self.trials < self.half_open_calls
+        return True
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN and self.trials < self.half_open_calls:
+            self.trials += 1
+            return True
+        if self.state == CLOSED:
+            return True
+        BREAKER_REJECTED.inc(self.name)
+        return False
+
+    def discard(self):
+        # A call let through that never reached the dependency: gives back
+        # its trial slot without counting an outcome
+        if self.state == HALF_OPEN and self.trials > 0:
+            self.trials -= 1
+
+    def record(self, elapsed: float, failed: bool = False):
+        failed = failed or 0 < self.slow_call_seconds < elapsed
+        if self.state == HALF_OPEN:
+            if failed:
+                self._transition(OPEN)
+            else:
+                self.trial_successes += 1
+                if self.trial_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            # A call let through before the breaker opened
+            return
+
+        if len(self.outcomes) == self.outcomes.maxlen:
+            self.failures -= self.outcomes[0]
+        self.outcomes.append(failed)
+        self.failures += failed
+        if (len(self.outcomes) >= self.min_calls
+                and self.failures >= self.failure_rate * len(self.outcomes)):
+            self._transition(OPEN)
+
+    def _transition(self, state: str):
+        logger.warning("Circuit breaker %s: %s -> %s", self.name, self.state, state)
+        BREAKER_TRANSITIONS.inc(self.name, self.state, state)
+        BREAKER_STATE.set(STATE_VALUES[state], self.name)
+        self.state = state
+        self.trials = 0
+        self.trial_successes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self.outcomes.clear()
+            self.failures = 0
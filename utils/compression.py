@@ -0,0 +1,46 @@
+import gzip
+from decouple import Csv, config
+
+# Bodies smaller than this go out as they are, gzip would barely shrink them
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+# 1 (fastest) to 9 (smallest). On item payloads 1 compresses about as well as
+# 5 or 9 for a fraction of the CPU, see benchmarks/compression_bench.py
+COMPRESSION_LEVEL = config('COMPRESSION_LEVEL', default=1, cast=int)
+# Media types worth compressing, text formats only
+COMPRESSION_TYPES = config(
+    'COMPRESSION_TYPES', cast=Csv(post_process=frozenset),
+    default='application/json,application/x-ndjson,text/csv,text/plain')
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    # gzip listed without q=0
+    for coding in (accept_encoding or '').lower().split(','):
+        name, _, params = coding.partition(';')
+        if name.strip() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def compressible(content_type: str) -> bool:
+    return content_type.split(';', 1)[0].strip().lower() in COMPRESSION_TYPES
+
+
+def add_vary(headers, field: str):
+    # Lists `field` in Vary unless it, or *, already is
+    vary = ', '.join(headers.getlist('vary'))
+    listed = {token.strip().lower() for token in vary.split(',')}
+    if field.lower() not in listed and '*' not in listed:
+        headers['Vary'] = f"{vary}, {field}" if vary else field
+
+
+def gzip_body(body: bytes, level: int = COMPRESSION_LEVEL):
+    # Compressed body, or None when it is too small to be worth it
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return None
+    # mtime=0 keeps the output, and so its ETag, the same for the same body
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def gzip_etag(etag: str) -> str:
+    # Each encoding of a resource needs its own strong ETag
+    return etag[:-1] + '-gzip"'
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from decouple import config
+from utils import metrics
+
+# JSON file with a list of groups replacing DEFAULT_GROUPS
+CONCURRENCY_GROUPS_FILE = config('CONCURRENCY_GROUPS_FILE', default='')
+# Seconds between two adjustments of an adaptive limit
+UPDATE_INTERVAL = config('CONCURRENCY_UPDATE_INTERVAL', default=0.1, cast=float)
+
+# Requests are grouped by path prefix (whole segments, the longest wins) and
+# every group has its own in-flight limit, so slow bcrypt logins cannot use
+# up the slots of cheap reads. Requests over the limit wait in a queue of
+# `queue_size` for at most `queue_timeout` seconds, then get a 503. With
+# `adaptive` the limit moves between `min_limit` and `max_limit` following
+# the observed latency; without it `initial_limit` is fixed (long streams
+# would distort the latency signal). Limits start low and grow while latency
+# allows, the lowest latency seen is the baseline. `limit: null` exempts a
+# prefix.
+DEFAULT_GROUPS = [
+    {"name": "default", "prefixes": ["/"], "initial_limit": 16, "min_limit": 4,
+     "max_limit": 256, "queue_size": 32, "queue_timeout": 0.2},
+    {"name": "reads", "prefixes": ["/items"], "initial_limit": 16, "min_limit": 4,
+     "max_limit": 512, "queue_size": 64, "queue_timeout": 0.2},
+    {"name": "auth", "prefixes": ["/users/authenticate", "/users/register",
+                                  "/users/create-admin"],
+     "initial_limit": 4, "min_limit": 2, "max_limit": 64, "queue_size": 16,
+     "queue_timeout": 0.5},
+    {"name": "bulk", "prefixes": ["/items/bulk", "/items/stream", "/admin/export"],
+     "adaptive": False, "initial_limit": 4, "queue_size": 4, "queue_timeout": 1.0},
+    {"name": "metrics", "prefixes": ["/metrics"], "limit": None},
+]
+
+REJECTED = metrics.counter(
+    'concurrency_rejected_total', 'Requests rejected with 503 by the concurrency limiter',
+    ('group', 'reason'))
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    'concurrency_queue_wait_seconds', 'Time admitted requests waited for a slot', ('group',))
+
+
+class GradientLimit:
+    # Gradient concurrency limit: compares the mean latency of the last
+    # interval with the lowest one seen over the last `long_window`
+    # intervals, the latency without queueing. While they stay within
+    # `tolerance` of each other the limit grows by about sqrt(limit) per
+    # interval; past it, requests are queueing somewhere and the limit
+    # shrinks by up to half.
+
+    def __init__(self, initial: float, min_limit: float, max_limit: float,
+                 tolerance: float = 1.5, smoothing: float = 0.2, long_window: int = 300,
+                 update_interval: float = UPDATE_INTERVAL):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.update_interval = update_interval
+        self.recent = deque(maxlen=long_window)  # Mean latency of past intervals
+        self.samples = 0
+        self.latency_sum = 0.0
+        self.max_in_flight = 0
+        self.updated_at = time.monotonic()
+
+    def on_sample(self, latency: float, in_flight: int):
+        self.samples += 1
+        self.latency_sum += latency
+        self.max_in_flight = max(self.max_in_flight, in_flight)
+        now = time.monotonic()
+        if now - self.updated_at >= self.update_interval and self.samples >= 5:
+            self._update(self.latency_sum / self.samples, self.max_in_flight)
+            self.samples = 0
+            self.latency_sum = 0.0
+            self.max_in_flight = 0
+            self.updated_at = now
+
+    def _update(self, latency: float, max_in_flight: int):
+        self.recent.append(latency)
+        baseline = min(self.recent)
+
+        gradient = max(0.5, min(1.0, self.tolerance * baseline / latency))
+        if gradient == 1.0 and max_in_flight < self.limit / 2:
+            # Not limited by us, growing further would mean nothing
+            return
+        target = self.limit * gradient + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+
+class ConcurrencyLimiter:
+    # In-flight counter with a bounded FIFO of waiters, event loop only
+
+    def __init__(self, name: str, initial_limit: int, queue_size: int, queue_timeout: float,
+                 adaptive: bool = True, min_limit: int = 1, max_limit: int = None):
+        self.name = name
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.adaptive = GradientLimit(initial_limit, min_limit, max_limit or initial_limit) \
+            if adaptive else None
+        self.fixed_limit = initial_limit
+        self.in_flight = 0
+        self.waiters = deque()
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self.adaptive.limit)) if self.adaptive else self.fixed_limit
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            REJECTED.inc(self.name, 'queue_full')
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                self._discard(waiter)
+                REJECTED.inc(self.name, 'timeout')
+                return False
+            # A slot was handed over just as the deadline passed, keep it
+        except asyncio.CancelledError:
+            # The client went away while queued
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._discard(waiter)
+            raise
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, self.name)
+        return True
+
+    def release(self, latency: float = None):
+        in_flight = self.in_flight
+        self.in_flight -= 1
+        if latency is not None and self.adaptive is not None:
+            self.adaptive.on_sample(latency, in_flight)
+        while self.waiters and self.in_flight < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def _discard(self, waiter):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def samples(self):
+        labels = {'group': self.name}
+        return [
+            ('concurrency_limit', 'gauge', 'Current in-flight limit', labels, self.limit),
+            ('concurrency_in_flight', 'gauge', 'Requests being served', labels, self.in_flight),
+            ('concurrency_queue_depth', 'gauge', 'Requests waiting for a slot',
+             labels, len(self.waiters)),
+        ]
+
+
+class ConcurrencyGroups:
+    def __init__(self, groups: list):
+        # (prefix, limiter or None), longest prefix first
+        self.limiters = []
+        self.prefixes = []
+        for group in groups:
+            limiter = None
+            if group.get('limit', True) is not None:
+                limiter = ConcurrencyLimiter(
+                    group['name'], group['initial_limit'], group.get('queue_size', 0),
+                    group.get('queue_timeout', 0.0), group.get('adaptive', True),
+                    group.get('min_limit', 1), group.get('max_limit'))
+                self.limiters.append(limiter)
+            for prefix in group['prefixes']:
+                self.prefixes.append((prefix.rstrip('/'), limiter))
+        self.prefixes.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+    def match(self, path: str):
+        for prefix, limiter in self.prefixes:
+            if path == prefix or path.startswith(prefix + '/'):
+                return limiter
+        return None
+
+    def samples(self):
+        return [sample for limiter in self.limiters for sample in limiter.samples()]
+
+
+def load_groups(path: str = CONCURRENCY_GROUPS_FILE) -> list:
+    if not path:
+        return DEFAULT_GROUPS
+    with open(path) as file:
+        return json.load(file)
+
+
+concurrency_groups = ConcurrencyGroups(load_groups())
+metrics.register_collector(concurrency_groups.samples)
@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine
+import asyncio
+from time import perf_counter
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from decouple import config
+from utils import metrics
 
 
 # SQLALCHEMY_DATABASE_ULR = config('DATABASE_URL') 
@@ -11,21 +16,170 @@ db_database = config('POSTGRES_DATABASE')
 db_host = config('POSTGRES_HOST')
 db_port = config('POSTGRES_PORT')
 
+# Connection pool of the async engine, per worker process
+db_pool_size = config('DB_POOL_SIZE', default=5, cast=int)
+db_max_overflow = config('DB_MAX_OVERFLOW', default=10, cast=int)
+db_pool_timeout = config('DB_POOL_TIMEOUT', default=30, cast=float)
+db_pool_recycle = config('DB_POOL_RECYCLE', default=1800, cast=int)
+
 SQLALCHEMY_DATABASE_URL = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_database}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{db_user}:{db_password}@{db_host}:{db_port}/{db_database}"
+
+# Engines and pools are created on first use, never at import, so a process
+# can import the app without touching the database and a pre-forking server
+# does not share connections between workers
+_engine = None
+_async_engine = None
+_session_factory = None
+
+
+def get_engine():
+    # The sync engine is only used for schema creation and migrations
+    global _engine
+    if _engine is None:
+        _engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    return _engine
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Times the wait for a connection, the checkout event only fires once one
+    # is taken. Includes opening a new one and waits that hit pool_timeout.
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(perf_counter() - started)
+
+
+def create_pooled_engine(url: str, pool_size: int = db_pool_size,
+                         max_overflow: int = db_max_overflow):
+    # Async engine with the pool settings and query metrics of the primary,
+    # also used for the read replicas
+    engine = create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=db_pool_timeout,
+        pool_recycle=db_pool_recycle,
+        pool_pre_ping=True,
+    )
+    _listen(engine.sync_engine)
+    return engine
+
+
+def session_factory(engine):
+    # Objects stay usable after commit without lazy loads, which would need
+    # an await the ORM attributes cannot do
+    return sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_pooled_engine(ASYNC_DATABASE_URL)
+    return _async_engine
+
+
+def new_session() -> AsyncSession:
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = session_factory(get_async_engine())
+    return _session_factory()
+
+
+QUERY_SECONDS = metrics.histogram(
+    'db_query_duration_seconds', 'Database query latency', ('operation',))
+POOL_CHECKOUTS = metrics.counter('db_pool_checkouts_total', 'Connections taken from the pool')
+QUERY_ERRORS = metrics.counter(
+    'db_query_errors_total', 'Database queries that raised', ('operation',))
+CONNECTION_HELD_SECONDS = metrics.histogram(
+    'db_connection_held_seconds', 'Time a connection stays checked out of the pool')
+POOL_WAIT_SECONDS = metrics.histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a connection from the pool')
+
+
+def operation_of(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement else 'UNKNOWN'
+
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The start time lives on the execution context of the statement, which goes
+# away with it whether the query succeeds or fails
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is not None:
+        QUERY_SECONDS.observe(perf_counter() - started, operation_of(statement))
+
+
+def on_error(exception_context):
+    QUERY_ERRORS.inc(operation_of(exception_context.statement))
+
+
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+    connection_record.info['checked_out_at'] = perf_counter()
+
+
+def on_checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop('checked_out_at', None)
+    if checked_out_at is not None:
+        CONNECTION_HELD_SECONDS.observe(perf_counter() - checked_out_at)
+
+
+def _listen(sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(sync_engine, "handle_error", on_error)
+    event.listen(sync_engine, "checkout", on_checkout)
+    event.listen(sync_engine, "checkin", on_checkin)
+
+
+def pool_samples():
+    if _async_engine is None:
+        return []
+    pool = _async_engine.pool
+    return [
+        ('db_pool_checked_out', 'gauge', 'Connections currently checked out', pool.checkedout()),
+        ('db_pool_size', 'gauge', 'Configured pool size', pool.size()),
+    ]
+
+
+metrics.register_collector(pool_samples)
 
 Base = declarative_base()
 
-# It's important to only call create_all after you've defined your models
-Base.metadata.create_all(bind=engine)
 
-Base.metadata.bind = engine
+def create_schema():
+    # Explicit command (python manage.py create-schema), the models must be
+    # imported for their tables to be in the metadata
+    from models import items_models, users_models  # noqa: F401
+    Base.metadata.create_all(bind=get_engine())
+
+
+async def prewarm(connections: int = db_pool_size):
+    # Opens `connections` pooled connections up front so the first requests
+    # do not pay for the connection handshakes
+    engine = get_async_engine()
+    opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    for connection in opened:
+        await connection.close()
+
+
+async def dispose():
+    global _engine, _async_engine, _session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+    _engine = _async_engine = _session_factory = None
+
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with new_session() as db:
         yield db
-    finally:
-        db.close()
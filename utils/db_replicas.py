@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import logging
+import time
+from decouple import Csv, config
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import make_url
+from utils import db, metrics
+
+logger = logging.getLogger(__name__)
+
+# Streaming replicas read-only handlers may use, comma separated, as
+# host:port (user, password and database of the primary) or full URLs.
+# Empty sends every read to the primary.
+DB_REPLICA_URLS = config('DB_REPLICA_URLS', default='', cast=Csv())
+# Seconds a replica may be behind the primary and still serve reads
+DB_REPLICA_MAX_LAG = config('DB_REPLICA_MAX_LAG', default=1.0, cast=float)
+DB_REPLICA_CHECK_INTERVAL = config('DB_REPLICA_CHECK_INTERVAL', default=1.0, cast=float)
+DB_REPLICA_CHECK_TIMEOUT = config('DB_REPLICA_CHECK_TIMEOUT', default=0.5, cast=float)
+DB_REPLICA_POOL_SIZE = config('DB_REPLICA_POOL_SIZE', default=db.db_pool_size, cast=int)
+DB_REPLICA_MAX_OVERFLOW = config('DB_REPLICA_MAX_OVERFLOW', default=db.db_max_overflow, cast=int)
+
+# Seconds of replay behind the primary: 0 when everything received is
+# replayed, NULL (unknown, never used) when the standby is not streaming.
+# A server out of recovery is a primary and has no lag.
+LAG_QUERY = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE GREATEST(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+READ_SESSIONS = metrics.counter(
+    'db_read_sessions_total', 'Read-only sessions by the server they were sent to', ('target',))
+
+
+def replica_url(entry: str) -> str:
+    if '://' in entry:
+        url = make_url(entry).set(drivername='postgresql+asyncpg')
+    else:
+        host, _, port = entry.partition(':')
+        url = make_url(db.ASYNC_DATABASE_URL).set(host=host, port=int(port or 5432))
+    return url.render_as_string(hide_password=False)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        parsed = make_url(url)
+        self.name = f"{parsed.host}:{parsed.port or 5432}"
+        # Not used until a health check has seen it streaming
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+        self._engine = None
+        self._session_factory = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = db.create_pooled_engine(
+                self.url, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW)
+        return self._engine
+
+    def new_session(self) -> AsyncSession:
+        if self._session_factory is None:
+            self._session_factory = db.session_factory(self.engine)
+        return self._session_factory()
+
+    async def _lag(self):
+        async with self.engine.connect() as connection:
+            return (await connection.execute(LAG_QUERY)).scalar()
+
+    async def check(self):
+        try:
+            lag = await asyncio.wait_for(self._lag(), DB_REPLICA_CHECK_TIMEOUT)
+        except Exception as error:
+            if self.healthy:
+                logger.warning("Replica %s failed its health check: %r", self.name, error)
+            self.healthy, self.lag = False, None
+        else:
+            if not self.healthy:
+                logger.info("Replica %s is up, %s s behind", self.name, lag)
+            self.healthy, self.lag = True, None if lag is None else float(lag)
+        self.checked_at = time.time()
+
+    async def dispose(self):
+        if self._engine is not None:
+            await self._engine.dispose()
+        self._engine = self._session_factory = None
+
+
+class ReplicaSet:
+    # Round-robin over the replicas whose last health check found them up and
+    # at most max_lag seconds behind; the primary when there is none
+
+    def __init__(self, urls: list = DB_REPLICA_URLS, max_lag: float = DB_REPLICA_MAX_LAG,
+                 check_interval: float = DB_REPLICA_CHECK_INTERVAL):
+        self.replicas = [Replica(replica_url(url)) for url in urls]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._task = None
+
+    @property
+    def staleness(self) -> float:
+        # Longest a replica that passed its last check can be behind: writes
+        # that must be read back go to the primary for this long
+        return self.max_lag + self.check_interval if self.replicas else 0.0
+
+    def usable(self, replica: Replica) -> bool:
+        return replica.healthy and replica.lag is not None and replica.lag <= self.max_lag
+
+    def pick(self):
+        count = len(self.replicas)
+        if count:
+            start = next(self._turn)
+            for offset in range(count):
+                replica = self.replicas[(start + offset) % count]
+                if self.usable(replica):
+                    return replica
+        return None
+
+    def new_session(self) -> AsyncSession:
+        replica = self.pick()
+        READ_SESSIONS.inc(replica.name if replica else 'primary')
+        return replica.new_session() if replica else db.new_session()
+
+    async def check(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        # Until this runs no replica is used, so scripts and tools that never
+        # start it read from the primary
+        if self.replicas and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            replica.healthy = False
+            await replica.dispose()
+
+    def stats(self) -> list:
+        return [{"name": replica.name, "healthy": replica.healthy, "lag": replica.lag,
+                 "usable": self.usable(replica), "checked_at": replica.checked_at}
+                for replica in self.replicas]
+
+    def samples(self):
+        samples = []
+        for replica in self.replicas:
+            labels = {'replica': replica.name}
+            samples.append(('db_replica_usable', 'gauge', 'Replica up and within the lag limit',
+                            labels, int(self.usable(replica))))
+            if replica.lag is not None:
+                samples.append(('db_replica_lag_seconds', 'gauge', 'Replay lag behind the primary',
+                                labels, replica.lag))
+        return samples
+
+
+replica_set = ReplicaSet()
+metrics.register_collector(replica_set.samples)
+
+
+def new_read_session() -> AsyncSession:
+    # For queries that tolerate DB_REPLICA_MAX_LAG of staleness; writes and
+    # reads of one's own writes use db.new_session()
+    return replica_set.new_session()
+
+
+async def get_read_db():
+    async with new_read_session() as session:
+        yield session
@@ -0,0 +1,59 @@
+import hashlib
+from bisect import bisect, insort
+
+# Virtual points per node, enough for an even spread with a handful of nodes
+DEFAULT_REPLICAS = 160
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    # Consistent hashing: adding or removing a node only moves the keys of
+    # the arcs that node owns, about 1/N of them
+
+    def __init__(self, nodes=(), replicas: int = DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self.nodes = []
+        self._points = []  # sorted hashes
+        self._owners = {}  # hash -> node
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            self._owners[point] = node
+            insort(self._points, point)
+
+    def remove_node(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+
+    def get_node(self, key: str):
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+    def iter_nodes(self, key: str):
+        # The owner of the key first, then the following distinct nodes
+        # clockwise, which take over its keys when it is unavailable
+        if not self._points:
+            return
+        start = bisect(self._points, _hash(key))
+        seen = set()
+        for offset in range(len(self._points)):
+            node = self._owners[self._points[(start + offset) % len(self._points)]]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from aioredis.exceptions import NoScriptError
+from decouple import config
+from utils.redis_shards import rate_limit_redis
+from utils.leaky_bucket import (BUCKET_CAPACITY, KEY_PREFIX, LEAK_RATE, LEAKY_BUCKET_SCRIPT,
+                                LEAKY_BUCKET_SHA, REDIS_SECONDS, bucket_args,
+                                check_bucket)
+
+logger = logging.getLogger(__name__)
+
+# Requests are decided locally while the estimated level stays below this
+# fraction of BUCKET_CAPACITY; above it every request goes to Redis
+LOCAL_FRACTION = config('RATE_LIMIT_LOCAL_FRACTION', default=0.5, cast=float)
+# How often locally admitted requests are pushed to Redis
+FLUSH_INTERVAL = config('RATE_LIMIT_FLUSH_INTERVAL_MS', default=5, cast=int) / 1000
+# Local state older than this is refreshed from Redis before it is trusted
+SYNC_MAX_AGE = config('RATE_LIMIT_SYNC_MAX_AGE', default=1.0, cast=float)
+# Upper bound of clients tracked per worker, least recently seen are evicted
+MAX_CLIENTS = config('RATE_LIMIT_LOCAL_MAX_CLIENTS', default=100000, cast=int)
+
+
+class LocalBucket:
+    __slots__ = ('level', 'synced_at', 'pending')
+
+    def __init__(self, level: float, synced_at: float):
+        self.level = level  # Global level reported by Redis at synced_at
+        self.synced_at = synced_at
+        self.pending = 0  # Requests admitted locally and not yet flushed
+
+    def estimate(self, now: float, leak_rate: float) -> float:
+        leaked = (now - self.synced_at) * leak_rate
+        return max(0.0, self.level - leaked) + self.pending
+
+
+class HybridLeakyBucket:
+    def __init__(self, capacity: float = BUCKET_CAPACITY, leak_rate: float = LEAK_RATE,
+                 flush_interval: float = FLUSH_INTERVAL,
+                 max_clients: int = MAX_CLIENTS, name: str = 'default'):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.local_limit = capacity * LOCAL_FRACTION
+        self.name = name
+        self.flush_interval = flush_interval
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        # Pending counts of evicted clients, flushed on the next tick
+        self.orphaned = {}
+        self.local_decisions = 0
+        self.redis_calls = 0
+        self._flusher = None
+
+    def _remember(self, client: str, bucket: LocalBucket):
+        self.buckets[client] = bucket
+        self.buckets.move_to_end(client)
+        while len(self.buckets) > self.max_clients:
+            evicted, old = self.buckets.popitem(last=False)
+            if old.pending:
+                self.orphaned[evicted] = self.orphaned.get(evicted, 0) + old.pending
+
+    def _restore(self, client: str, pending: int):
+        # Gives back counts that could not be pushed to Redis
+        if not pending:
+            return
+        bucket = self.buckets.get(client)
+        if bucket is not None:
+            bucket.pending += pending
+        else:
+            self.orphaned[client] = self.orphaned.get(client, 0) + pending
+
+    async def allow(self, client: str) -> bool:
+        allowed, _ = await self.check(client)
+        return allowed
+
+    async def check(self, client: str):
+        # Returns (allowed, estimated level of the bucket)
+        if self._flusher is None:
+            self.start()
+
+        now = time.time()
+        bucket = self.buckets.get(client)
+
+        if bucket is not None and now - bucket.synced_at < SYNC_MAX_AGE:
+            level = bucket.estimate(now, self.leak_rate) + 1
+            if level <= self.local_limit:
+                bucket.pending += 1
+                self.buckets.move_to_end(client)
+                self.local_decisions += 1
+                return True, level
+
+        # Close to the limit or unknown client: decide in Redis, pushing what
+        # this worker admitted since the last flush along with it
+        admitted = 0
+        if bucket is not None:
+            admitted, bucket.pending = bucket.pending, 0
+
+        self.redis_calls += 1
+        try:
+            allowed, level = await check_bucket(
+                client, admitted=admitted, capacity=self.capacity, leak_rate=self.leak_rate)
+        except Exception:
+            self._restore(client, admitted)
+            raise
+
+        bucket = self.buckets.get(client) or LocalBucket(level, now)
+        bucket.level = level
+        bucket.synced_at = now
+        self._remember(client, bucket)
+        return allowed, level
+
+    async def flush(self):
+        # Counts move out of the local buckets before the await so concurrent
+        # decisions never push them twice
+        batch = {}
+        for client, bucket in self.buckets.items():
+            if bucket.pending > 0:
+                batch[client], bucket.pending = bucket.pending, 0
+        for client, pending in self.orphaned.items():
+            batch[client] = batch.get(client, 0) + pending
+        self.orphaned = {}
+
+        if not batch:
+            return
+
+        # One pipeline per Redis node, all nodes flushed concurrently
+        by_key = {f"{KEY_PREFIX}{client}": client for client in batch}
+        groups = {url: [by_key[key] for key in keys]
+                  for url, keys in rate_limit_redis.group(by_key).items()}
+        for client in set(batch) - {client for clients in groups.values() for client in clients}:
+            self._restore(client, batch[client])
+
+        now = time.time()
+        self.redis_calls += len(groups)
+        with REDIS_SECONDS.time('hybrid_flush'):
+            results = await asyncio.gather(
+                *(rate_limit_redis.call_node(
+                    url, lambda node, clients=clients: self._flush_node(node, clients, batch),
+                    check_latency=False)
+                  for url, clients in groups.items()),
+                return_exceptions=True)
+
+        for (url, clients), levels in zip(groups.items(), results):
+            if isinstance(levels, BaseException):
+                logger.error("Failed to flush local rate limit counts to %s: %r", url, levels)
+                for client in clients:
+                    self._restore(client, batch[client])
+                continue
+
+            for client, (_, level) in zip(clients, levels):
+                bucket = self.buckets.get(client)
+                if bucket is not None:
+                    bucket.level = float(level)
+                    bucket.synced_at = now
+
+    async def _flush_node(self, node, clients: list, batch: dict):
+        for attempt in range(2):
+            async with node.pipeline(transaction=False) as pipe:
+                for client in clients:
+                    keys, args = bucket_args(client, cost=0, admitted=batch[client],
+                                             capacity=self.capacity, leak_rate=self.leak_rate)
+                    pipe.evalsha(LEAKY_BUCKET_SHA, len(keys), *keys, *args)
+                try:
+                    return await pipe.execute()
+                except NoScriptError:
+                    if attempt:
+                        raise
+                    await node.script_load(LEAKY_BUCKET_SCRIPT)
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def samples(self):
+        labels = {'rule': self.name}
+        return [
+            ('rate_limit_local_decisions_total', 'counter',
+             'Requests admitted without asking Redis', labels, self.local_decisions),
+            ('rate_limit_redis_calls_total', 'counter',
+             'Redis calls made by the hybrid limiter', labels, self.redis_calls),
+            ('rate_limit_local_clients', 'gauge', 'Clients tracked in-process',
+             labels, len(self.buckets)),
+        ]
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+from decouple import config
+from utils import metrics
+from utils.db_replicas import replica_set
+from utils.redis_connection import get_redis
+
+logger = logging.getLogger(__name__)
+
+ITEMS_CACHE_ENABLED = config('ITEMS_CACHE_ENABLED', default=True, cast=bool)
+ITEMS_CACHE_TTL = config('ITEMS_CACHE_TTL', default=60, cast=int)
+
+# Bumped on every write to the items table. It is part of every page key, so
+# a bump makes all cached pages unreachable at once and they simply expire.
+VERSION_KEY = "items_cache:version"
+# Exists for a moment after each write, while a replica may not have it yet.
+# Pages rendered meanwhile are read from the primary so a stale page is not
+# cached under the new version.
+WRITTEN_KEY = "items_cache:written"
+
+stats = {"hits": 0, "misses": 0, "not_modified": 0, "errors": 0}
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(','))
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+
+def page_key(version: int, *parts) -> str:
+    return f"items_cache:v{version}:" + ":".join(str(part) for part in parts)
+
+
+async def get_version():
+    # None when Redis is unavailable, callers then skip the cache
+    try:
+        return int(await get_redis().get(VERSION_KEY) or 0)
+    except Exception:
+        logger.exception("Items cache version read failed")
+        stats["errors"] += 1
+        return None
+
+
+async def get_page(key: str):
+    # Returns (body, etag, next_cursor, gzipped body or None) or None on a miss
+    try:
+        cached = await get_redis().hgetall(key)
+    except Exception:
+        logger.exception("Items cache read failed")
+        stats["errors"] += 1
+        cached = None
+
+    if not cached:
+        stats["misses"] += 1
+        return None
+
+    stats["hits"] += 1
+    next_cursor = cached.get(b"next") or None
+    return (cached[b"body"], cached[b"etag"].decode(), next_cursor and next_cursor.decode(),
+            cached.get(b"gzip") or None)
+
+
+async def set_page(key: str, body: bytes, etag: str, next_cursor: str = None,
+                   gzipped: bytes = None):
+    # The gzip variant is stored next to the body so hits never recompress
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            await (pipe
+                   .hset(key, mapping={"body": body, "etag": etag, "next": next_cursor or "",
+                                       "gzip": gzipped or b""})
+                   .expire(key, ITEMS_CACHE_TTL)
+                   .execute())
+    except Exception:
+        logger.exception("Items cache write failed")
+        stats["errors"] += 1
+
+
+def cache_samples():
+    return [('items_cache_events_total', 'counter', 'Items cache lookups by outcome',
+             {'event': event}, count) for event, count in stats.items()]
+
+
+metrics.register_collector(cache_samples)
+
+
+async def recently_written() -> bool:
+    if not replica_set.staleness:
+        return False
+    try:
+        return bool(await get_redis().exists(WRITTEN_KEY))
+    except Exception:
+        logger.exception("Items cache written flag read failed")
+        stats["errors"] += 1
+        return True
+
+
+async def invalidate_items() -> bool:
+    # Call after any change to the items table. A failure is logged and the
+    # write still succeeds, cached pages then live out their ITEMS_CACHE_TTL.
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.incr(VERSION_KEY)
+            if replica_set.staleness:
+                pipe.set(WRITTEN_KEY, 1, px=int(replica_set.staleness * 1000))
+            await pipe.execute()
+    except Exception:
+        logger.exception("Items cache invalidation failed")
+        stats["errors"] += 1
+        return False
+    return True
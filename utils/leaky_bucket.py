@@ -1,39 +1,80 @@
+import hashlib
+import math
 import time
-from utils.redis_connection import redis
+from utils import metrics
+from utils.redis_connection import run_script
+from utils.redis_shards import rate_limit_redis
 
 # Constants for the leaky bucket
 BUCKET_CAPACITY = 10  # Maximum capacity of the bucket
 LEAK_RATE = 1  # Leaks per second
 
+KEY_PREFIX = "rate_limit:"
 
-async def leaky_bucket(request_id: str) -> bool:
-    current_time = time.time()
+REDIS_SECONDS = metrics.histogram(
+    'rate_limit_redis_duration_seconds', 'Latency of rate limiter Redis calls', ('operation',))
 
-    # Transaction block to ensure atomicity
-    async with redis.pipeline(transaction=True) as pipe:
-        # Get the last updated time and the current size of the bucket
-        last_updated, bucket_size = await (pipe
-                                           .get(f"{request_id}_last_updated")
-                                           .get(f"{request_id}_bucket_size")
-                                           .execute())
+# Reads, leaks, fills and writes the bucket in one atomic step. The state of
+# every client lives in a single hash with a TTL.
+#
+# KEYS[1] = bucket key
+# ARGV    = capacity, leak rate, current time, cost, ttl, admitted
+# `admitted` are requests a worker already let through on its own (hybrid
+# mode); they are always added, capped at the capacity.
+# Returns {allowed (1/0), current level}
+LEAKY_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local leak_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[5])
+local admitted = tonumber(ARGV[6]) or 0
 
-        last_updated = float(last_updated or current_time)
-        bucket_size = int(bucket_size or 0)
+local state = redis.call('HMGET', KEYS[1], 'level', 'ts')
+local level = tonumber(state[1]) or 0
+local last_updated = tonumber(state[2]) or now
 
-        # Calculate the leaked amount
-        leaked = int((current_time - last_updated) * LEAK_RATE)
-        bucket_size = max(0, bucket_size - leaked)
+level = math.max(0, level - math.max(0, now - last_updated) * leak_rate)
+level = math.min(capacity, level + admitted)
 
-        # Check if a request can be added
-        if bucket_size < BUCKET_CAPACITY:
-            bucket_size += 1
-            # Update the bucket size and last updated time
-            await (pipe
-                   .set(f"{request_id}_last_updated", current_time)
-                   .set(f"{request_id}_bucket_size", bucket_size)
-                   .execute())
-            return True
-        return False
+local allowed = 0
+if level + cost <= capacity then
+    level = level + cost
+    allowed = 1
+end
 
+redis.call('HSET', KEYS[1], 'level', tostring(level), 'ts', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ttl)
 
+return {allowed, tostring(level)}
+"""
 
+LEAKY_BUCKET_SHA = hashlib.sha1(LEAKY_BUCKET_SCRIPT.encode()).hexdigest()
+
+
+def bucket_ttl(capacity: float, leak_rate: float) -> int:
+    # Idle buckets are fully drained after capacity / rate seconds, so their
+    # keys can expire without changing any decision
+    return math.ceil(capacity / leak_rate) + 1
+
+
+def bucket_args(request_id: str, cost: int = 1, admitted: int = 0,
+                capacity: float = BUCKET_CAPACITY, leak_rate: float = LEAK_RATE):
+    # Keys and arguments of one LEAKY_BUCKET_SCRIPT call
+    return ([f"{KEY_PREFIX}{request_id}"],
+            [capacity, leak_rate, time.time(), cost, bucket_ttl(capacity, leak_rate), admitted])
+
+
+async def check_bucket(request_id: str, cost: int = 1, admitted: int = 0,
+                       capacity: float = BUCKET_CAPACITY, leak_rate: float = LEAK_RATE):
+    keys, args = bucket_args(request_id, cost, admitted, capacity, leak_rate)
+    with REDIS_SECONDS.time('leaky_bucket'):
+        allowed, level = await rate_limit_redis.call(keys[0], lambda client: run_script(
+            LEAKY_BUCKET_SHA, LEAKY_BUCKET_SCRIPT, keys, args, client))
+
+    return allowed == 1, float(level)
+
+
+async def leaky_bucket(request_id: str, cost: int = 1) -> bool:
+    allowed, _ = await check_bucket(request_id, cost)
+    return allowed
@@ -0,0 +1,158 @@
+from bisect import bisect_left
+from time import perf_counter
+
+# In-process metrics rendered in the Prometheus text format. Everything is
+# updated from the event loop thread, so no locks are taken; histograms are
+# pre-bucketed and an observation is a bisect plus two additions.
+
+# Seconds, from sub-millisecond Redis calls to multi-second requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = {}
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.series = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labelnames, labels, le), cumulative)
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), total
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), count
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.started, *self.labels)
+
+
+def _register(metric_class, name: str, *args, **kwargs):
+    # Registering twice returns the existing metric
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = metric_class(name, *args, **kwargs)
+    return metric
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (),
+              buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, documentation, labelnames, buckets)
+
+
+def register_collector(collector):
+    # `collector()` is called on every scrape and returns gauges/counters
+    # read from state kept elsewhere, as (name, kind, documentation, value)
+    # or (name, kind, documentation, {label_name: label_value}, value)
+    _collectors.append(collector)
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics.values():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+
+    # Samples of one metric must be contiguous, several collectors may
+    # report the same metric with different labels
+    collected = sorted((sample for collector in _collectors for sample in collector()),
+                       key=lambda sample: sample[0])
+    described = set()
+    for sample in collected:
+        name, kind, documentation = sample[:3]
+        labels = sample[3] if len(sample) == 5 else {}
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} '
+                     f'{_format_value(sample[-1])}')
+
+    return '\n'.join(lines) + '\n'
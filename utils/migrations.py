@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import os
+import sys
+from sqlalchemy import text
+from utils import db
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations')
+
+
+def pending_migrations(applied: set) -> list:
+    names = sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith('.sql'))
+    return [name for name in names if name not in applied]
+
+
+def data_migrations() -> list:
+    # (name, coroutine function) of the steps that are not plain SQL, run
+    # after the files and recorded the same way
+    from database import session_store
+    steps = []
+    if session_store.SESSION_STORE == 'redis':
+        # Only once the sessions are read from Redis, tokens stored in the
+        # database until then would be missed otherwise
+        steps.append(('003_backfill_redis_sessions', session_store.backfill_redis_sessions))
+    return steps
+
+
+async def run_step(step):
+    from utils.redis_connection import close_redis
+    try:
+        await step()
+    finally:
+        # The event loop of asyncio.run ends with the step
+        await close_redis()
+        await db.get_async_engine().dispose()
+
+
+def statements(path: str) -> list:
+    # Files hold plain statements separated by semicolons, comments allowed
+    with open(path) as file:
+        lines = [line for line in file if not line.lstrip().startswith('--')]
+    return [statement.strip() for statement in ''.join(lines).split(';') if statement.strip()]
+
+
+def apply_migrations(engine=None) -> list:
+    # Applies the SQL files of migrations/ in name order, each once. They run
+    # in autocommit mode so they may use CREATE INDEX CONCURRENTLY, and every
+    # statement must be safe to re-run (IF NOT EXISTS).
+    engine = engine or db.get_engine()
+    applied_now = []
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'name TEXT PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())'))
+        applied = {row[0] for row in connection.execute(text('SELECT name FROM schema_migrations'))}
+
+        for name in pending_migrations(applied):
+            logger.info("Applying migration %s", name)
+            for statement in statements(os.path.join(MIGRATIONS_DIR, name)):
+                connection.execute(text(statement))
+            connection.execute(text('INSERT INTO schema_migrations (name) VALUES (:name)'),
+                               {'name': name})
+            applied_now.append(name)
+
+        for name, step in data_migrations():
+            if name in applied:
+                continue
+            logger.info("Applying migration %s", name)
+            asyncio.run(run_step(step))
+            connection.execute(text('INSERT INTO schema_migrations (name) VALUES (:name)'),
+                               {'name': name})
+            applied_now.append(name)
+    return applied_now
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    applied = apply_migrations()
+    print(f"Applied {len(applied)} migration(s): {', '.join(applied) or 'none'}", file=sys.stderr)
@@ -0,0 +1,29 @@
+import base64
+import json
+from fastapi import HTTPException, status
+
+
+# Cursors are opaque to clients: url-safe base64 of the keyset values of the
+# last row of a page
+
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def is_int(value) -> bool:
+    # JSON true/false decode to bool, a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        values = None
+
+    if not isinstance(values, dict):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decouple import config
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from utils import metrics
+
+# bcrypt takes a few hundred milliseconds of CPU, so it never runs on the
+# event loop. "thread" is enough because bcrypt releases the GIL, "process"
+# isolates it completely.
+PASSWORD_POOL_KIND = config('PASSWORD_POOL_KIND', default='thread')
+PASSWORD_POOL_WORKERS = config(
+    'PASSWORD_POOL_WORKERS', default=os.cpu_count() or 1, cast=int)
+# Calls allowed to wait for a worker before new ones are rejected with 503
+PASSWORD_POOL_QUEUE_SIZE = config('PASSWORD_POOL_QUEUE_SIZE', default=32, cast=int)
+PASSWORD_POOL_RETRY_AFTER = config('PASSWORD_POOL_RETRY_AFTER', default=1, cast=int)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+PASSWORD_SECONDS = metrics.histogram(
+    'password_hash_duration_seconds', 'CPU time of bcrypt calls', ('operation',))
+PASSWORD_WAIT_SECONDS = metrics.histogram(
+    'password_pool_wait_seconds', 'Time bcrypt calls wait for a pool worker')
+
+
+# Module level functions so they can be pickled into a process pool
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return pwd_context.verify(password, password_hash)
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class PasswordPool:
+    def __init__(self, kind: str = PASSWORD_POOL_KIND, workers: int = PASSWORD_POOL_WORKERS,
+                 queue_size: int = PASSWORD_POOL_QUEUE_SIZE):
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        self.calls = {"hash": 0, "verify": 0}
+        self.seconds = {"hash": 0.0, "verify": 0.0}
+        self.max_seconds = {"hash": 0.0, "verify": 0.0}
+        self.wait_seconds = 0.0
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            executor_class = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+            self._executor = executor_class(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, name: str, fn, *args):
+        if self.in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, try again later",
+                headers={"Retry-After": str(PASSWORD_POOL_RETRY_AFTER)},
+            )
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            result, elapsed = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed, fn, *args)
+        finally:
+            self.in_flight -= 1
+
+        self.calls[name] += 1
+        self.seconds[name] += elapsed
+        self.max_seconds[name] = max(self.max_seconds[name], elapsed)
+        waited = time.perf_counter() - started - elapsed
+        self.wait_seconds += waited
+        PASSWORD_SECONDS.observe(elapsed, name)
+        PASSWORD_WAIT_SECONDS.observe(waited)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.workers),
+            "rejected": self.rejected,
+            "calls": dict(self.calls),
+            "seconds_total": dict(self.seconds),
+            "seconds_max": dict(self.max_seconds),
+            "wait_seconds_total": self.wait_seconds,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def samples(self):
+        return [
+            ('password_pool_in_flight', 'gauge', 'bcrypt calls running or queued', self.in_flight),
+            ('password_pool_queue_depth', 'gauge', 'bcrypt calls waiting for a worker',
+             max(0, self.in_flight - self.workers)),
+            ('password_pool_rejected_total', 'counter', 'bcrypt calls rejected with 503',
+             self.rejected),
+        ]
+
+
+password_pool = PasswordPool()
+metrics.register_collector(password_pool.samples)
+
+
+async def hash_password(password: str) -> str:
+    return await password_pool.run("hash", _hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await password_pool.run("verify", _verify, password, password_hash)
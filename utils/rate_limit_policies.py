@@ -0,0 +1,149 @@
+import json
+from decouple import config
+from utils import metrics
+from utils.leaky_bucket import BUCKET_CAPACITY, LEAK_RATE
+from utils.rate_limiters import LIMITERS, HybridLeakyBucketLimiter, LocalLimiter
+
+# JSON file with a list of rules replacing DEFAULT_POLICIES
+RATE_LIMIT_POLICY_FILE = config('RATE_LIMIT_POLICY_FILE', default='')
+# "redis" decides every request in Redis, "hybrid" decides leaky bucket rules
+# in-process while a client is well under the limit and syncs counts to Redis
+# in batches
+RATE_LIMIT_MODE = config('RATE_LIMIT_MODE', default='redis')
+# What a rule does when Redis cannot be reached (or its circuit breaker is
+# open): "open" lets requests through unlimited, "closed" rejects them with
+# 503, "local" limits them in-process per worker
+RATE_LIMIT_ON_ERROR = config('RATE_LIMIT_ON_ERROR', default='local')
+
+# A rule applies to every path under `prefix` (whole segments), the longest
+# prefix wins. `key` is what is limited: "ip", "user" (username of the access
+# token, the IP without one) or "api_key" (X-API-Key header, the IP without
+# one). `algorithm` is "leaky_bucket", "gcra", "sliding_window" or "none" to
+# exempt the prefix. `limit` requests are allowed per `period` seconds.
+# `on_error` overrides RATE_LIMIT_ON_ERROR for the rule.
+DEFAULT_POLICIES = [
+    {"name": "default", "prefix": "/", "key": "ip", "algorithm": "leaky_bucket",
+     "limit": BUCKET_CAPACITY, "period": BUCKET_CAPACITY / LEAK_RATE},
+    {"name": "items", "prefix": "/items", "methods": ["GET"], "key": "user",
+     "algorithm": "gcra", "limit": 100, "period": 10},
+    {"name": "login", "prefix": "/users/authenticate", "key": "ip",
+     "algorithm": "sliding_window", "limit": 10, "period": 60},
+    {"name": "register", "prefix": "/users/register", "key": "ip",
+     "algorithm": "sliding_window", "limit": 5, "period": 60},
+    {"name": "create-admin", "prefix": "/users/create-admin", "key": "api_key",
+     "algorithm": "sliding_window", "limit": 5, "period": 60},
+    {"name": "metrics", "prefix": "/metrics", "key": "ip", "algorithm": "none"},
+]
+
+IDENTITY_KEYS = ('ip', 'user', 'api_key')
+FAILURE_MODES = ('open', 'closed', 'local')
+
+
+class Rule:
+    __slots__ = ('name', 'prefix', 'methods', 'key', 'limiter', 'on_error', 'fallback')
+
+    def __init__(self, name: str, prefix: str, methods, key: str, limiter,
+                 on_error: str = RATE_LIMIT_ON_ERROR, fallback=None):
+        self.name = name
+        self.prefix = prefix
+        self.methods = methods
+        self.key = key
+        self.limiter = limiter  # None for exempt prefixes
+        self.on_error = on_error
+        self.fallback = fallback  # LocalLimiter when on_error is "local"
+
+
+class _Node:
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+
+
+def _segments(path: str) -> list:
+    return [segment for segment in path.split('/') if segment]
+
+
+class PolicyTable:
+    # Rules compiled into a trie of path segments, a lookup walks the
+    # segments of the request path once
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self.root = _Node()
+        for rule in rules:
+            node = self.root
+            for segment in _segments(rule.prefix):
+                node = node.children.setdefault(segment, _Node())
+            node.rules.append(rule)
+            # Method specific rules are tried before catch-all ones
+            node.rules.sort(key=lambda rule: rule.methods is None)
+
+    def match(self, method: str, path: str):
+        node = self.root
+        matched = self._match_node(node, method)
+        for segment in _segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            matched = self._match_node(node, method) or matched
+        return matched
+
+    @staticmethod
+    def _match_node(node: _Node, method: str):
+        for rule in node.rules:
+            if rule.methods is None or method in rule.methods:
+                return rule
+        return None
+
+    async def stop(self):
+        for rule in self.rules:
+            if rule.limiter is not None:
+                await rule.limiter.stop()
+
+    def samples(self):
+        return [sample for rule in self.rules
+                if isinstance(rule.limiter, HybridLeakyBucketLimiter)
+                for sample in rule.limiter.bucket.samples()]
+
+
+def load_policies(path: str = RATE_LIMIT_POLICY_FILE) -> list:
+    if not path:
+        return DEFAULT_POLICIES
+    with open(path) as file:
+        return json.load(file)
+
+
+def compile_policies(policies: list, mode: str = RATE_LIMIT_MODE) -> PolicyTable:
+    rules = []
+    for policy in policies:
+        name = policy['name']
+        key = policy.get('key', 'ip')
+        algorithm = policy.get('algorithm', 'leaky_bucket')
+        on_error = policy.get('on_error', RATE_LIMIT_ON_ERROR)
+        if key not in IDENTITY_KEYS:
+            raise ValueError(f"Rate limit rule {name}: unknown key {key!r}")
+        if on_error not in FAILURE_MODES:
+            raise ValueError(f"Rate limit rule {name}: unknown on_error {on_error!r}")
+
+        limiter = fallback = None
+        if algorithm != 'none':
+            if algorithm not in LIMITERS:
+                raise ValueError(f"Rate limit rule {name}: unknown algorithm {algorithm!r}")
+            limiter_class = LIMITERS[algorithm]
+            if algorithm == 'leaky_bucket' and mode == 'hybrid':
+                limiter_class = HybridLeakyBucketLimiter
+            limiter = limiter_class(name, policy['limit'], float(policy['period']))
+            if on_error == 'local':
+                fallback = LocalLimiter(name, policy['limit'], float(policy['period']))
+
+        methods = policy.get('methods')
+        rules.append(Rule(name, policy.get('prefix', '/'),
+                          frozenset(m.upper() for m in methods) if methods else None,
+                          key, limiter, on_error, fallback))
+    return PolicyTable(rules)
+
+
+policy_table = compile_policies(load_policies())
+metrics.register_collector(policy_table.samples)
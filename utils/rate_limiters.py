@@ -0,0 +1,203 @@
+import hashlib
+import math
+from abc import ABC, abstractmethod
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from utils.hybrid_bucket import MAX_CLIENTS, HybridLeakyBucket
+from utils.leaky_bucket import KEY_PREFIX, REDIS_SECONDS, check_bucket
+from utils.redis_connection import run_script
+from utils.redis_shards import rate_limit_redis
+
+# Generic cell rate algorithm: a single "theoretical arrival time" per key.
+# Each request pushes it forward by one emission interval and is allowed
+# while it stays within the burst tolerance of now.
+#
+# KEYS[1] = key
+# ARGV    = current time, emission interval, burst tolerance, cost
+# Returns {allowed (1/0), retry after, time until fully replenished}
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tolerance = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local tat = math.max(tonumber(redis.call('GET', KEYS[1])) or now, now)
+local new_tat = tat + interval * cost
+local allow_at = new_tat - tolerance
+
+if now < allow_at then
+    return {0, tostring(allow_at - now), tostring(tat - now)}
+end
+
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0', tostring(new_tat - now)}
+"""
+
+# Sliding window approximated from the counts of the current and previous
+# fixed windows, the previous one weighted by how much of it still overlaps.
+#
+# KEYS[1] = key
+# ARGV    = current time, window length, limit, cost
+# Returns {allowed (1/0), weighted count, retry after}
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local window = math.floor(now / period)
+local elapsed = now - window * period
+local state = redis.call('HMGET', KEYS[1], 'w', 'cur', 'prev')
+local stored = tonumber(state[1])
+local cur = tonumber(state[2]) or 0
+local prev = tonumber(state[3]) or 0
+
+if stored == window - 1 then
+    prev = cur
+    cur = 0
+elseif stored ~= window then
+    prev = 0
+    cur = 0
+end
+
+local count = prev * (1 - elapsed / period) + cur
+if count + cost > limit then
+    local retry = period - elapsed
+    if prev > 0 and cur + cost <= limit then
+        retry = period * (1 - (limit - cur - cost) / prev) - elapsed
+    end
+    return {0, tostring(count), tostring(math.max(0, retry))}
+end
+
+redis.call('HSET', KEYS[1], 'w', window, 'cur', cur + cost, 'prev', prev)
+redis.call('PEXPIRE', KEYS[1], math.ceil(period * 2000))
+return {1, tostring(count + cost), '0'}
+"""
+
+GCRA_SHA = hashlib.sha1(GCRA_SCRIPT.encode()).hexdigest()
+SLIDING_WINDOW_SHA = hashlib.sha1(SLIDING_WINDOW_SCRIPT.encode()).hexdigest()
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # Seconds until the limit is fully available again
+    retry_after: float  # Seconds until a denied request may be retried
+    period: float
+
+    def headers(self) -> list:
+        headers = [
+            (b'ratelimit-limit', str(self.limit).encode()),
+            (b'ratelimit-remaining', str(max(0, self.remaining)).encode()),
+            (b'ratelimit-reset', str(math.ceil(self.reset_after)).encode()),
+            (b'ratelimit-policy', f'{self.limit};w={math.ceil(self.period)}'.encode()),
+        ]
+        if not self.allowed:
+            headers.append((b'retry-after', str(max(1, math.ceil(self.retry_after))).encode()))
+        return headers
+
+
+async def _run(algorithm: str, sha: str, script: str, key: str, args: list):
+    with REDIS_SECONDS.time(algorithm):
+        return await rate_limit_redis.call(
+            key, lambda client: run_script(sha, script, [key], args, client))
+
+
+class Limiter(ABC):
+    # `limit` requests per `period` seconds for every identity
+    def __init__(self, name: str, limit: int, period: float):
+        self.name = name
+        self.limit = limit
+        self.period = period
+
+    @abstractmethod
+    async def check(self, identity: str) -> Decision:
+        pass
+
+    async def stop(self):
+        pass
+
+
+class LeakyBucketLimiter(Limiter):
+    def __init__(self, name: str, limit: int, period: float):
+        super().__init__(name, limit, period)
+        self.leak_rate = limit / period
+
+    def decision(self, allowed: bool, level: float) -> Decision:
+        retry_after = 0.0 if allowed else (level + 1 - self.limit) / self.leak_rate
+        return Decision(allowed, self.limit, math.floor(self.limit - level),
+                        level / self.leak_rate, retry_after, self.period)
+
+    async def check(self, identity: str) -> Decision:
+        allowed, level = await check_bucket(
+            f"{self.name}:{identity}", capacity=self.limit, leak_rate=self.leak_rate)
+        return self.decision(allowed, level)
+
+
+class HybridLeakyBucketLimiter(LeakyBucketLimiter):
+    def __init__(self, name: str, limit: int, period: float):
+        super().__init__(name, limit, period)
+        self.bucket = HybridLeakyBucket(self.limit, self.leak_rate, name=name)
+
+    async def check(self, identity: str) -> Decision:
+        allowed, level = await self.bucket.check(f"{self.name}:{identity}")
+        return self.decision(allowed, level)
+
+    async def stop(self):
+        await self.bucket.stop()
+
+
+class GCRALimiter(Limiter):
+    async def check(self, identity: str) -> Decision:
+        interval = self.period / self.limit
+        allowed, retry_after, used = await _run(
+            'gcra', GCRA_SHA, GCRA_SCRIPT, f"{KEY_PREFIX}{self.name}:{identity}",
+            [time.time(), interval, self.period, 1])
+        used = float(used)
+        remaining = math.floor((self.period - used) / interval) if allowed == 1 else 0
+        return Decision(allowed == 1, self.limit, remaining, used,
+                        float(retry_after), self.period)
+
+
+class SlidingWindowLimiter(Limiter):
+    async def check(self, identity: str) -> Decision:
+        now = time.time()
+        allowed, count, retry_after = await _run(
+            'sliding_window', SLIDING_WINDOW_SHA, SLIDING_WINDOW_SCRIPT,
+            f"{KEY_PREFIX}{self.name}:{identity}", [now, self.period, self.limit, 1])
+        return Decision(allowed == 1, self.limit, math.floor(self.limit - float(count)),
+                        self.period - now % self.period, float(retry_after), self.period)
+
+
+class LocalLimiter(Limiter):
+    # GCRA kept in-process, the fallback of rules while Redis is unreachable.
+    # Workers do not share it, so a client gets up to `limit` per worker.
+    def __init__(self, name: str, limit: int, period: float, max_clients: int = MAX_CLIENTS):
+        super().__init__(name, limit, period)
+        self.interval = period / limit
+        self.max_clients = max_clients
+        self.tats = OrderedDict()  # identity -> theoretical arrival time
+
+    async def check(self, identity: str) -> Decision:
+        now = time.monotonic()
+        tat = max(self.tats.get(identity, now), now)
+        new_tat = tat + self.interval
+        allow_at = new_tat - self.period
+        if now < allow_at:
+            return Decision(False, self.limit, 0, tat - now, allow_at - now, self.period)
+
+        self.tats[identity] = new_tat
+        self.tats.move_to_end(identity)
+        while len(self.tats) > self.max_clients:
+            self.tats.popitem(last=False)
+        remaining = math.floor((self.period - (new_tat - now)) / self.interval)
+        return Decision(True, self.limit, remaining, new_tat - now, 0.0, self.period)
+
+
+LIMITERS = {
+    'leaky_bucket': LeakyBucketLimiter,
+    'gcra': GCRALimiter,
+    'sliding_window': SlidingWindowLimiter,
+}
@@ -1,5 +1,84 @@
-from aioredis import Redis, from_url
+import asyncio
+from aioredis import BlockingConnectionPool, Redis
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from aioredis.exceptions import NoScriptError
+from decouple import config
 
-redis: Redis = None
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379')
+# Per process, for each Redis client created from a URL
+REDIS_MAX_CONNECTIONS = config('REDIS_MAX_CONNECTIONS', default=50, cast=int)
+# Seconds a call waits for a pooled connection when all of them are busy
+REDIS_POOL_TIMEOUT = config('REDIS_POOL_TIMEOUT', default=1.0, cast=float)
 
-redis = from_url("redis://localhost:6379")
\ No newline at end of file
+_redis: Redis = None
+
+
+class PoolExhausted(RedisConnectionError):
+    # No pooled connection came free in time: this worker is busy, the node
+    # itself may be fine
+    pass
+
+
+class WaitingConnectionPool(BlockingConnectionPool):
+    # Calls past max_connections wait for a connection to be released instead
+    # of failing at once. BlockingConnectionPool raises the ConnectionError of
+    # an unreachable node when the wait times out, this raises PoolExhausted.
+
+    async def get_connection(self, command_name, *keys, **options):
+        self._checkpid()
+        try:
+            connection = await asyncio.wait_for(self.pool.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolExhausted(f"No Redis connection free within {self.timeout}s") from None
+
+        # None is a free slot without a connection yet
+        if connection is None:
+            connection = self.make_connection()
+        try:
+            await connection.connect()
+            # A connection with unread data, or closed by the server, is
+            # reconnected as the parent class does
+            try:
+                if await connection.can_read():
+                    raise RedisConnectionError("Connection has data") from None
+            except RedisConnectionError:
+                await connection.disconnect()
+                await connection.connect()
+                if await connection.can_read():
+                    raise RedisConnectionError("Connection not ready") from None
+        except BaseException:
+            await self.release(connection)
+            raise
+        return connection
+
+
+def redis_client(url: str, max_connections: int = REDIS_MAX_CONNECTIONS,
+                 pool_timeout: float = REDIS_POOL_TIMEOUT, **options) -> Redis:
+    return Redis(connection_pool=WaitingConnectionPool.from_url(
+        url, max_connections=max_connections, timeout=pool_timeout, **options))
+
+
+def get_redis() -> Redis:
+    # Built on first use, never at import
+    global _redis
+    if _redis is None:
+        _redis = redis_client(REDIS_URL)
+    return _redis
+
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
+
+
+async def run_script(sha: str, script: str, keys: list, args: list, client: Redis = None):
+    # Call the script by SHA and only send the source when Redis does not
+    # know it yet (first call, restart or SCRIPT FLUSH)
+    client = client or get_redis()
+    try:
+        return await client.evalsha(sha, len(keys), *keys, *args)
+    except NoScriptError:
+        await client.script_load(script)
+        return await client.evalsha(sha, len(keys), *keys, *args)
@@ -0,0 +1,145 @@
+import logging
+from time import perf_counter
+from urllib.parse import urlsplit
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from aioredis.exceptions import TimeoutError as RedisTimeoutError
+from decouple import Csv, config
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.hash_ring import HashRing
+from utils.redis_connection import REDIS_MAX_CONNECTIONS, REDIS_URL, PoolExhausted, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Redis nodes holding the rate limiter state, comma separated URLs
+RATE_LIMIT_REDIS_NODES = config('RATE_LIMIT_REDIS_NODES', default=REDIS_URL, cast=Csv())
+# Deadline of every call to a node (connect, and each read or write on the
+# socket). A limiter call that takes longer is worth less than failing fast.
+REDIS_TIMEOUT = config('RATE_LIMIT_REDIS_TIMEOUT', default=0.05, cast=float)
+# Nodes tried for one key before giving up, so a failing key costs at most
+# this many deadlines until the breakers open
+MAX_ATTEMPTS = config('RATE_LIMIT_REDIS_MAX_ATTEMPTS', default=2, cast=int)
+
+# Errors that mean the node is unreachable, as opposed to a bad command.
+# PoolExhausted is a subclass but is handled before them: it only says every
+# connection of this worker is busy.
+NODE_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError)
+
+
+class NoRedisNodeAvailable(RedisConnectionError):
+    pass
+
+
+def node_name(url: str) -> str:
+    # host:port, a metric label must not carry the password of the URL
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}"
+
+
+class RedisShards:
+    # Spreads keys over several Redis nodes with a consistent hash ring, one
+    # connection pool per node, created on first use. Each node has a
+    # circuit breaker; keys of a node whose breaker is open go to the next
+    # node on the ring until it closes again.
+
+    def __init__(self, urls=RATE_LIMIT_REDIS_NODES, max_connections: int = REDIS_MAX_CONNECTIONS,
+                 timeout: float = REDIS_TIMEOUT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.clients = {}
+        self.breakers = {}
+        self.ring = HashRing()
+        for url in urls:
+            self.add_node(url)
+
+    def add_node(self, url: str):
+        self.ring.add_node(url)
+        if url not in self.breakers:
+            self.breakers[url] = CircuitBreaker(f"redis:{node_name(url)}")
+
+    def client(self, url: str):
+        client = self.clients.get(url)
+        if client is None:
+            # Waiting for a free connection is bounded by the same deadline
+            client = self.clients[url] = redis_client(
+                url, self.max_connections, self.timeout,
+                socket_timeout=self.timeout, socket_connect_timeout=self.timeout)
+        return client
+
+    async def remove_node(self, url: str):
+        self.ring.remove_node(url)
+        self.breakers.pop(url, None)
+        client = self.clients.pop(url, None)
+        if client is not None:
+            await client.close()
+
+    def is_up(self, url: str) -> bool:
+        return self.breakers[url].available()
+
+    def node_for(self, key: str):
+        # First available node for the key, or None when every node is down
+        return next((url for url in self.ring.iter_nodes(key) if self.is_up(url)), None)
+
+    async def call_node(self, url: str, operation, check_latency: bool = True):
+        # Runs `operation(client)` on one node through its breaker. Batched
+        # operations pass check_latency=False, they are slow by nature and
+        # only their errors count.
+        breaker = self.breakers[url]
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for Redis node {node_name(url)}")
+        settled = False
+        started = perf_counter()
+        try:
+            result = await operation(self.client(url))
+            breaker.record(perf_counter() - started if check_latency else 0.0)
+            settled = True
+            return result
+        except PoolExhausted:
+            raise
+        except NODE_ERRORS as error:
+            logger.warning("Redis node %s unavailable: %r", node_name(url), error)
+            breaker.record(perf_counter() - started if check_latency else 0.0, True)
+            settled = True
+            raise
+        finally:
+            # Pool exhausted, cancelled, or an error answered by the node
+            # (BUSY, OOM, NOSCRIPT...): says nothing about whether it is
+            # reachable, but a half-open trial slot must be given back or
+            # the node stays refused for good
+            if not settled:
+                breaker.discard()
+
+    async def call(self, key: str, operation):
+        # Runs `operation(client)` on the node owning the key, failing over
+        # along the ring when a node is unreachable or its breaker is open
+        attempts = 0
+        for url in self.ring.iter_nodes(key):
+            if not self.is_up(url):
+                continue
+            try:
+                return await self.call_node(url, operation)
+            except PoolExhausted:
+                # Another node would not be any less busy, and its counts
+                # are not the key's
+                raise
+            except (CircuitOpenError, *NODE_ERRORS):
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    break
+        raise NoRedisNodeAvailable(f"No Redis node available for {key}")
+
+    def group(self, keys):
+        # Splits keys by the node that currently serves them
+        groups = {}
+        for key in keys:
+            url = self.node_for(key)
+            if url is not None:
+                groups.setdefault(url, []).append(key)
+        return groups
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+        self.clients.clear()
+
+
+rate_limit_redis = RedisShards()
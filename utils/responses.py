@@ -0,0 +1,8 @@
+from fastapi.responses import Response
+
+
+class RawJSONResponse(Response):
+    # Body already encoded to JSON bytes. An endpoint returning a Response
+    # skips FastAPI's response_model validation and jsonable_encoder pass,
+    # the response_model is then only used for the OpenAPI schema.
+    media_type = 'application/json'
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from decouple import config
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils import db, metrics
+from utils.redis_connection import get_redis, run_script
+
+logger = logging.getLogger(__name__)
+
+# "local" runs identical concurrent calls of a worker once and shares the
+# result, "redis" also across workers: one takes a lock in Redis and the
+# others wait for the result it publishes there. "off" disables it.
+SINGLE_FLIGHT_MODE = config('SINGLE_FLIGHT_MODE', default='local')
+# Longest a call may hold the Redis lock, waiters run the call themselves
+# after that
+SINGLE_FLIGHT_LOCK_TTL = config('SINGLE_FLIGHT_LOCK_TTL', default=5.0, cast=float)
+# Seconds a published result stays readable by the workers waiting for it
+SINGLE_FLIGHT_RESULT_TTL = config('SINGLE_FLIGHT_RESULT_TTL', default=1.0, cast=float)
+SINGLE_FLIGHT_POLL_INTERVAL = config('SINGLE_FLIGHT_POLL_INTERVAL', default=0.005, cast=float)
+
+KEY_PREFIX = "single_flight:"
+
+# Deletes the lock only while it is still ours, it may have expired and been
+# taken by another worker
+#
+# KEYS[1] = lock key
+# ARGV    = token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+RELEASE_SHA = hashlib.sha1(RELEASE_SCRIPT.encode()).hexdigest()
+
+# outcome: "run" executed the call, "shared" awaited the same call of this
+# worker, "remote" got the result another worker published
+CALLS = metrics.counter(
+    'single_flight_calls_total', 'Coalesced calls by outcome', ('flight', 'outcome'))
+
+
+class SingleFlight:
+    # One in-flight call per key. `encode`/`decode` turn a result into bytes
+    # and back, without them the flight stays local to the worker.
+
+    def __init__(self, name: str, encode=None, decode=None, mode: str = SINGLE_FLIGHT_MODE):
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.mode = mode if mode != 'redis' or encode else 'local'
+        self.calls = {}  # key -> task
+
+    async def do(self, key: str, fn):
+        # `fn` is a coroutine function. Its task is shielded, so a caller
+        # going away does not cancel it for the others.
+        if self.mode == 'off':
+            return await fn()
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(self._run(key, fn))
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            CALLS.inc(self.name, 'shared')
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fn):
+        if self.mode == 'redis':
+            digest = hashlib.sha1(key.encode()).hexdigest()
+            try:
+                return await self._run_shared(f"{KEY_PREFIX}{self.name}:{digest}", fn)
+            except _NotShared:
+                pass
+        CALLS.inc(self.name, 'run')
+        return await fn()
+
+    async def _run_shared(self, key: str, fn):
+        # The lock holds the token of the call running, which publishes its
+        # result under that token: waiters only read the result of the call
+        # they joined, never one left by an earlier call of the same key
+        redis = get_redis()
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + SINGLE_FLIGHT_LOCK_TTL
+        while time.monotonic() < deadline:
+            try:
+                locked = await redis.set(lock_key, token, nx=True,
+                                         px=int(SINGLE_FLIGHT_LOCK_TTL * 1000))
+            except Exception as error:
+                logger.warning("Single flight lock failed: %r", error)
+                raise _NotShared()
+
+            if locked:
+                CALLS.inc(self.name, 'run')
+                try:
+                    result = await fn()
+                    try:
+                        await redis.set(f"{key}:result:{token}", self.encode(result),
+                                        px=int(SINGLE_FLIGHT_RESULT_TTL * 1000))
+                    except Exception as error:
+                        logger.warning("Single flight result write failed: %r", error)
+                    return result
+                finally:
+                    try:
+                        await run_script(RELEASE_SHA, RELEASE_SCRIPT, [lock_key], [token])
+                    except Exception as error:
+                        logger.warning("Single flight unlock failed: %r", error)
+
+            # Another worker runs it: wait for its result, or for the lock to
+            # change hands without one (it failed) and try to take it
+            try:
+                holder = await redis.get(lock_key)
+            except Exception as error:
+                logger.warning("Single flight wait failed: %r", error)
+                raise _NotShared()
+            if holder is None:
+                continue
+            result_key = f"{key}:result:{holder.decode()}"
+            while time.monotonic() < deadline:
+                await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+                try:
+                    # The result is written before the lock is released
+                    result, current = await redis.mget(result_key, lock_key)
+                except Exception as error:
+                    logger.warning("Single flight wait failed: %r", error)
+                    raise _NotShared()
+                if result is not None:
+                    CALLS.inc(self.name, 'remote')
+                    return self.decode(result)
+                if current != holder:
+                    break
+        # The holder is stuck past the lock TTL
+        raise _NotShared()
+
+
+class _NotShared(Exception):
+    # Redis could not coordinate the call, it runs in this worker alone
+    pass
+
+
+# Session factory per engine, sessions get the settings of utils/db.py
+_factories = {}
+
+
+def query_key(session: AsyncSession, statement) -> str:
+    # Same SQL with the same parameters on the same server
+    compiled = statement.compile(dialect=session.bind.dialect)
+    return f"{session.bind.url!r}|{compiled}|{sorted(compiled.params.items())!r}"
+
+
+async def fetch(flight: SingleFlight, session: AsyncSession, statement, handle):
+    # Executes `statement` once for every identical concurrent call and
+    # returns handle(result) to all of them. It gets a session of its own on
+    # the caller's server, the request that started it may end first.
+    if flight.mode == 'off':
+        return handle(await session.execute(statement))
+
+    factory = _factories.get(session.bind)
+    if factory is None:
+        factory = _factories[session.bind] = db.session_factory(session.bind)
+
+    async def run():
+        async with factory() as own:
+            return handle(await own.execute(statement))
+
+    return await flight.do(query_key(session, statement), run)
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from decouple import config
+from utils import metrics
+
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class ClaimsCache:
+    # Decoded JWT claims keyed by a digest of the token, kept until the
+    # token's exp and evicted least recently used first. Caching revokes
+    # nothing and extends nothing: an access token stays valid until its exp
+    # after a logout, as it did before the cache.
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # digest -> (exp, claims)
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        digest = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        if exp is None:
+            return
+        digest = token_digest(token)
+        with self._lock:
+            self._entries[digest] = (exp, claims)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def samples(self):
+        return [
+            ('token_cache_hits_total', 'counter', 'JWT decodes served from cache', self.hits),
+            ('token_cache_misses_total', 'counter', 'JWT decodes not in cache', self.misses),
+            ('token_cache_size', 'gauge', 'Cached JWT claims', len(self._entries)),
+        ]
+
+
+claims_cache = ClaimsCache()
+metrics.register_collector(claims_cache.samples)